@@ -1,6 +1,16 @@
 from .make_altibar_frame import make_altibar_frame
 from .make_minimap_frame import make_minimap_frame
 from .make_minimap_frame import initialize_minimap
+from .make_minimap_frame import update_minimap
+from .make_minimap_frame import render_minimap
 from .make_goal_field import make_goal_field
+from .layer_cache import get_font
+from .layer_cache import draw_text
+from .frame_writer import FFmpegStream
+from .frame_writer import get_ffmpeg_command
+from .frame_renderer import init_render_state
+from .frame_renderer import render_frames
+from .frame_renderer import render_frames_serial
+from .frame_renderer import render_frames_parallel
 
 
@@ -0,0 +1,199 @@
+from PIL import Image, ImageDraw, ImageFont
+from collections import deque
+import multiprocessing
+from .make_altibar_frame import make_altibar_frame
+from .make_altibar_frame import get_altibar_values
+from .make_altibar_frame import get_altibar_key
+from .make_minimap_frame import initialize_minimap
+from .make_minimap_frame import update_minimap
+from .make_minimap_frame import render_minimap
+from .make_minimap_frame import get_minimap_key
+from .make_goal_field import make_goal_field
+from .make_goal_field import get_goal_texts
+from .layer_cache import draw_text
+
+frames_per_chunk = 30 # Frames per render task
+
+
+def init_render_state(track_points, map_images, outline_image, settings):
+    # Everything that is drawn incrementally: path on the minimaps and on the outline
+    state = {
+        'path_images': [img.copy() for img in map_images],
+        'frame_memory': initialize_minimap(track_points[0], len(map_images), settings['res_scale'], settings['width']),
+        'outline_image': outline_image.copy(),
+        'next_index': 0,
+    }
+    return state
+
+
+def advance_render_state(state, track_points, i, settings):
+    # Draws path segments for frame i without rendering the frame
+    res_scale = settings['res_scale']
+    track_point = track_points[i]
+    if i == 0:
+        track_point_prev = track_point
+    else:
+        track_point_prev = track_points[i - 1]
+    state['path_images'], state['frame_memory'] = update_minimap(state['frame_memory'], state['path_images'], i, track_point, track_point_prev, res_scale)
+
+    # Draws path on outline image with only path
+    if i > 0:
+        draw4 = ImageDraw.Draw(state['outline_image'])
+        draw4.line((track_point_prev["outline_x"], track_point_prev["outline_y"], track_point["outline_x"], track_point["outline_y"]), fill=(255,0,0,200), width=round(res_scale))
+    state['next_index'] = i + 1
+
+
+def render_frame(state, track_points, i, settings):
+    # Renders frame i, state must be advanced to frame i
+    width = settings['width']
+    anim_height = settings['anim_height']
+    res_scale = settings['res_scale']
+    no_points = len(track_points)
+    animation_frame = Image.new("RGBA", (width, anim_height), (0, 0, 0, 0))
+
+    # Extract data
+    track_point = track_points[i]
+    localtime = track_point["local_time"]
+    altitude = track_point["altitude"]
+    elevation = track_point["elevation"]
+    vario = track_point["vario"]
+    altitude_lr = track_point["altitude_lr"]
+    elevation_lr = track_point["elevation_lr"]
+    vario_lr = track_point["vario_lr"]
+
+    # STEP 1: MINI-MAP
+    minimap_frame = render_minimap(state['frame_memory'], state['path_images'], i, no_points, track_point, settings['map_metadata'], res_scale, width)
+    position_minimap = (0, animation_frame.size[1] - minimap_frame.size[1])
+    animation_frame.paste(minimap_frame, position_minimap, minimap_frame)
+
+    # STEP 2: OUTLINE-MAP
+    x_outline = track_point["outline_x"]
+    y_outline = track_point["outline_y"]
+    # Draws dot at the end of path (but doesnt mess with outline_image)
+    outline_with_dot = state['outline_image'].copy()
+    draw5 = ImageDraw.Draw(outline_with_dot)
+    draw5.ellipse([x_outline - 3*res_scale, y_outline - 3*res_scale, x_outline + 3*res_scale, y_outline + 3*res_scale], fill='red', outline ='black')
+
+    position_outline = (round(10*res_scale), round(anim_height*0.1))
+    animation_frame.paste(outline_with_dot, position_outline, outline_with_dot)
+
+    # STEP 3: ALTIBAR
+    altibar_height = round(280 * res_scale)
+    elevation_active = (i != 0) and (i != no_points-1)
+    altibar_image = make_altibar_frame(width, altibar_height, res_scale, altitude, elevation, vario, vario_lr, settings['max_altitude'], altitude_lr, elevation_lr, elevation_active)
+    altibar_y = position_minimap[1] - altibar_height - round(anim_height*0.05)
+    animation_frame.paste(altibar_image, (0,altibar_y), altibar_image)
+
+    # STEP 5: DRAW TEXT
+    # Draw datetime
+    current_time = localtime.strftime("%H:%M")
+    current_date = localtime.strftime("%Y-%m-%d")
+
+    draw_text(animation_frame, (30*res_scale,30*res_scale), current_time, round(40*res_scale), 'white')
+    draw_text(animation_frame, (38*res_scale,76*res_scale), current_date, round(16*res_scale), 'white')
+
+    # Draw goal
+    goal_height = round(60*res_scale)
+    goal_field_y = position_minimap[1] - goal_height
+    goal_field_frame = make_goal_field(settings['goal_type'], track_point, width, goal_height, res_scale, settings['goal_text_reference'])
+    animation_frame.paste(goal_field_frame, (0,goal_field_y), goal_field_frame)
+
+    return animation_frame
+
+
+def get_frame_key(state, track_points, i, settings):
+    # Rounded inputs of every layer. Consecutive frames with equal keys look the same.
+    res_scale = settings['res_scale']
+    no_points = len(track_points)
+    track_point = track_points[i]
+    localtime = track_point["local_time"]
+    elevation_active = (i != 0) and (i != no_points-1)
+    altibar_values = get_altibar_values(round(280 * res_scale), track_point["altitude"], track_point["elevation"], track_point["vario"], track_point["vario_lr"], settings['max_altitude'], track_point["altitude_lr"], track_point["elevation_lr"], elevation_active)
+    frame_key = (
+        get_minimap_key(state['frame_memory'], i, no_points, track_point, track_points[i - 1] if i > 0 else None, settings['map_metadata'], settings['width']),
+        round(track_point["outline_x"]),
+        round(track_point["outline_y"]),
+        get_altibar_key(altibar_values),
+        localtime.strftime("%H:%M"),
+        localtime.strftime("%Y-%m-%d"),
+        get_goal_texts(settings['goal_type'], track_point, settings['goal_text_reference']),
+    )
+    return frame_key
+
+
+def render_frames(state, track_points, start, stop, settings):
+    # Yields frames start..stop-1, fast-forwarding the path state to start first.
+    # With skip_identical, yields None instead of a frame that looks like the one before.
+    for i in range(state['next_index'], start):
+        advance_render_state(state, track_points, i, settings)
+    last_frame_key = None
+    if settings['skip_identical'] and start > 0:
+        # State is at the frame before the chunk, so repeats carry on across chunks
+        last_frame_key = get_frame_key(state, track_points, start - 1, settings)
+    for i in range(start, stop):
+        advance_render_state(state, track_points, i, settings)
+        if settings['skip_identical']:
+            frame_key = get_frame_key(state, track_points, i, settings)
+            if frame_key == last_frame_key:
+                yield None
+                continue
+            last_frame_key = frame_key
+        yield render_frame(state, track_points, i, settings)
+
+
+def render_frames_serial(track_points, map_images, outline_image, settings):
+    # Same chunks as the parallel renderer, so both give identical output
+    state = init_render_state(track_points, map_images, outline_image, settings)
+    no_points = len(track_points)
+    for start in range(0, no_points, frames_per_chunk):
+        stop = min(start + frames_per_chunk, no_points)
+        yield from render_frames(state, track_points, start, stop, settings)
+
+
+# Per-process data for the parallel renderer
+_worker = {}
+
+def _init_worker(track_points, map_images, outline_image, settings):
+    _worker['track_points'] = track_points
+    _worker['map_images'] = map_images
+    _worker['outline_image'] = outline_image
+    _worker['settings'] = settings
+    _worker['state'] = None
+
+
+def _render_chunk(start, stop):
+    # A worker gets its chunks in increasing order, so it only has to fast-forward
+    # from its previous chunk. Anything else means starting over from frame 0.
+    state = _worker['state']
+    if state is None or state['next_index'] > start:
+        state = init_render_state(_worker['track_points'], _worker['map_images'], _worker['outline_image'], _worker['settings'])
+        _worker['state'] = state
+    frames = render_frames(state, _worker['track_points'], start, stop, _worker['settings'])
+    return [None if frame is None else frame.tobytes() for frame in frames]
+
+
+def render_frames_parallel(track_points, map_images, outline_image, settings, workers):
+    # Yields frames in order (None for repeated frames) while a process pool renders chunks of frames ahead
+    frame_size = (settings['width'], settings['anim_height'])
+    no_points = len(track_points)
+    chunk_starts = iter(range(0, no_points, frames_per_chunk))
+    max_pending = 2 * workers # Limits memory used by finished but unwritten chunks
+
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(track_points, map_images, outline_image, settings)) as pool:
+        pending = deque()
+        def submit_next():
+            start = next(chunk_starts, None)
+            if start is not None:
+                stop = min(start + frames_per_chunk, no_points)
+                pending.append(pool.apply_async(_render_chunk, (start, stop)))
+
+        for _ in range(max_pending):
+            submit_next()
+        while pending:
+            frames = pending.popleft().get()
+            submit_next()
+            for frame_bytes in frames:
+                if frame_bytes is None:
+                    yield None
+                else:
+                    yield Image.frombytes("RGBA", frame_size, frame_bytes)
@@ -0,0 +1,88 @@
+import subprocess
+import tempfile
+
+
+def get_ffmpeg_command(input_args, fps, transparent, output_path='media/animation.mov'):
+    # ProRes 4444 output, with or without alpha channel
+    if transparent == True:
+        pix_fmt = 'yuva444p10le'  # This enables the alpha channel
+    else:
+        pix_fmt = 'yuv444p10le'  # No alpha channel
+    ffmpeg_command = [
+        'ffmpeg',
+        '-y',
+        '-framerate', str(fps),
+        *input_args,
+        '-vcodec', 'prores_ks',
+        '-profile:v', '4444',  # This is for ProRes 4444
+        '-pix_fmt', pix_fmt,
+        output_path
+    ]
+    return ffmpeg_command
+
+
+class FFmpegStream:
+    # Long-running ffmpeg process that encodes raw RGBA frames piped over stdin
+    def __init__(self, width, height, fps, transparent, output_path='media/animation.mov'):
+        self.frame_size = (width, height)
+        self.frame_bytes = width * height * 4
+        input_args = [
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgba',
+            '-s', f'{width}x{height}',
+            '-i', '-',
+        ]
+        ffmpeg_command = get_ffmpeg_command(input_args, fps, transparent, output_path)
+        # stderr goes to a temp file so a chatty ffmpeg can never fill the pipe and stall us
+        self.stderr_file = tempfile.TemporaryFile()
+        try:
+            self.process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.stderr_file)
+        except FileNotFoundError:
+            self.stderr_file.close()
+            raise RuntimeError("ffmpeg not found. Install ffmpeg and make sure it is on PATH.")
+
+    def write(self, frame):
+        # Accepts an RGBA image or its raw bytes
+        if not isinstance(frame, (bytes, bytearray, memoryview)):
+            if frame.size != self.frame_size:
+                raise ValueError(f"Frame size {frame.size} does not match stream size {self.frame_size}")
+            frame = frame.convert("RGBA").tobytes()
+        elif len(frame) != self.frame_bytes:
+            raise ValueError(f"Frame has {len(frame)} bytes, expected {self.frame_bytes}")
+        try:
+            self.process.stdin.write(frame)
+        except (BrokenPipeError, OSError):
+            self._fail()
+
+    def close(self):
+        # Flush remaining frames and wait for ffmpeg to finish the file
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        return_code = self.process.wait()
+        if return_code != 0:
+            self._fail()
+        self.stderr_file.close()
+
+    def abort(self):
+        # Stop ffmpeg without waiting for it to finish encoding
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        self.stderr_file.close()
+
+    def _fail(self):
+        # ffmpeg died (or refused input); surface its own error message
+        if self.process.poll() is None:
+            self.process.kill()
+        return_code = self.process.wait()
+        self.stderr_file.seek(0)
+        stderr_lines = self.stderr_file.read().decode('utf-8', errors='replace').strip().splitlines()
+        self.stderr_file.close()
+        message = '\n'.join(stderr_lines[-10:])
+        raise RuntimeError(f"ffmpeg exited with code {return_code}:\n{message}")
@@ -0,0 +1,38 @@
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    # Loading a truetype font is slow, so keep one per size
+    return ImageFont.truetype("arial.ttf", size)
+
+
+@lru_cache(maxsize=4096)
+def get_text_length(text, size):
+    return get_font(size).getlength(text)
+
+
+@lru_cache(maxsize=1024)
+def get_text_tile(text, size, fill, stroke_width=0, stroke_fill=None):
+    # Renders a string once on a transparent tile, reused until the string changes
+    font = get_font(size)
+    left, top, right, bottom = font.getbbox(text, stroke_width=stroke_width)
+    tile = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(tile)
+    draw.text((-left, -top), text, font=font, fill=fill, stroke_width=stroke_width, stroke_fill=stroke_fill)
+    return tile, left, top
+
+
+def draw_text(image, xy, text, size, fill, stroke_width=0, stroke_fill=None):
+    # Same as ImageDraw.text on an RGBA image, but composites a cached text tile
+    # (positions are rounded to whole pixels)
+    if text == "":
+        return
+    tile, left, top = get_text_tile(text, size, fill, stroke_width, stroke_fill)
+    x = round(xy[0]) + left
+    y = round(xy[1]) + top
+    if -x >= tile.size[0] or -y >= tile.size[1]:
+        return
+    # alpha_composite can't start outside the image, so skip that part of the tile instead
+    image.alpha_composite(tile, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
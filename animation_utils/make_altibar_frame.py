@@ -1,29 +1,41 @@
 from PIL import Image, ImageDraw, ImageFont
+from functools import lru_cache
+from .layer_cache import draw_text, get_text_length
 
-def make_altibar_frame(w, h, scale, altitude, elevation, vario, vario_lr, max_altitude, altitude_lr, elevation_lr, elevation_active):
+
+@lru_cache(maxsize=16)
+def get_altibar_background(w, h, scale, bar_max):
+    # Static part of the altibar (empty bar and top label), built once
     image = Image.new("RGBA", (w, h), (0, 0, 0, 0))
     draw = ImageDraw.Draw(image)
     textsize = round(20*scale)
-    font = ImageFont.truetype("arial.ttf", textsize)
-
-    bar_max = max(2000, int(max_altitude/1000 + 1) * 1000)
 
     bar_width = 30*scale
     bar_height = round(h*0.8)
     bar_x = 86 * scale
     bar_y = round(h*0.1)
 
+    # Draw bar
+    draw.rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], fill=(240, 240, 240, 180), outline ='black', width=round(2*scale))
+
+    # Draw bar max
+    barmax_text = f"{bar_max}"
+    barmax_text_width = get_text_length(barmax_text, textsize)
+    draw_text(image, (bar_x-barmax_text_width-8*scale, bar_y - textsize/2), barmax_text, textsize, 'white', stroke_width=1, stroke_fill='black')
+
+    return image
+
+
+def get_altibar_values(h, altitude, elevation, vario, vario_lr, max_altitude, altitude_lr, elevation_lr, elevation_active):
+    # Everything the dynamic part of the altibar depends on
+    bar_max = max(2000, int(max_altitude/1000 + 1) * 1000)
+    bar_height = round(h*0.8)
+
     # Find y-positions
     altibar_pilot = altitude / bar_max * bar_height
     altibar_ground = elevation / bar_max * bar_height
 
-    # Draw bar
-    draw.rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], fill=(240, 240, 240, 180), outline ='black', width=round(2*scale))
-    draw.rectangle([bar_x, bar_y + bar_height - altibar_ground, bar_x + bar_width, bar_y + bar_height], fill=(200, 255, 200, 120), outline ='black', width=round(2*scale))
-    
-    # Draw arrow
-    arrow = [(-1,0), (1,0), (1,3), (2,3), (0,6), (-2,3), (-1,3)]
-    arrow_width = 8
+    # Find arrow size
     ah_max = round(h*0.2)
     if vario < -0.5: # lift
         arrow_height = -min(5,-vario) / 5 * ah_max / 6
@@ -31,38 +43,86 @@ def make_altibar_frame(w, h, scale, altitude, elevation, vario, vario_lr, max_al
         arrow_height = ah_max/2/6
     else: # calm
         arrow_height = 0
-    
-    arrow_x = bar_x + bar_width/2
-    arrow_y = bar_y + bar_height - altibar_pilot
-    scaled_arrow = [(arrow_x + px * arrow_width, arrow_y + py * arrow_height) for px, py in arrow]
-    draw.polygon(scaled_arrow, fill=(255, 40, 40, 220), outline ='black', width=round(2*scale))
-
-    # Draw pilot bar
-    draw.rectangle([bar_x, bar_y + bar_height - altibar_pilot - 3*scale, bar_x + bar_width, bar_y + bar_height - altibar_pilot + 3*scale], fill="red", outline ='black', width=round(2*scale))
-
 
-    # Find text positions
+    # Find texts
     pilot_text = f"{round(altitude_lr/10)*10} m"
     if elevation_active:
         ground_text = f"{round(elevation_lr/10)*10}"
     else:
         ground_text = ""
 
-    barmax_text = f"{bar_max}"
     if arrow_height == 0:
         vario_text = ""
     else:
         vario_text = f"{abs(round(vario_lr))} m/s"
+
+    altibar_values = {
+        'bar_max': bar_max,
+        'altibar_pilot': altibar_pilot,
+        'altibar_ground': altibar_ground,
+        'arrow_height': arrow_height,
+        'pilot_text': pilot_text,
+        'ground_text': ground_text,
+        'vario_text': vario_text,
+    }
+    return altibar_values
+
+
+def get_altibar_key(altibar_values):
+    # Rounded to whole pixels: equal keys give (practically) identical altibars
+    return (
+        altibar_values['bar_max'],
+        round(altibar_values['altibar_pilot']),
+        round(altibar_values['altibar_ground']),
+        round(altibar_values['arrow_height'], 1),
+        altibar_values['pilot_text'],
+        altibar_values['ground_text'],
+        altibar_values['vario_text'],
+    )
+
+
+def make_altibar_frame(w, h, scale, altitude, elevation, vario, vario_lr, max_altitude, altitude_lr, elevation_lr, elevation_active, altibar_values=None):
+    if altibar_values is None:
+        altibar_values = get_altibar_values(h, altitude, elevation, vario, vario_lr, max_altitude, altitude_lr, elevation_lr, elevation_active)
+    bar_max = altibar_values['bar_max']
+    altibar_pilot = altibar_values['altibar_pilot']
+    altibar_ground = altibar_values['altibar_ground']
+    arrow_height = altibar_values['arrow_height']
+    pilot_text = altibar_values['pilot_text']
+    ground_text = altibar_values['ground_text']
+    vario_text = altibar_values['vario_text']
+
+    textsize = round(20*scale)
+    image = get_altibar_background(w, h, scale, bar_max).copy()
+    draw = ImageDraw.Draw(image)
+
+    bar_width = 30*scale
+    bar_height = round(h*0.8)
+    bar_x = 86 * scale
+    bar_y = round(h*0.1)
+
+    # Draw ground
+    draw.rectangle([bar_x, bar_y + bar_height - altibar_ground, bar_x + bar_width, bar_y + bar_height], fill=(200, 255, 200, 120), outline ='black', width=round(2*scale))
     
-    ground_text_width = draw.textlength(ground_text, font=font)
-    pilot_text_width = draw.textlength(pilot_text, font=font)
-    barmax_text_width = draw.textlength(barmax_text, font=font)
-
-    # Draw text
-    draw.text((bar_x-ground_text_width-8*scale, bar_y + bar_height-altibar_ground - textsize/2), ground_text, font=font, fill='white', stroke_width=1, stroke_fill='black')
-    draw.text((bar_x-barmax_text_width-8*scale, bar_y - textsize/2), barmax_text, font=font, fill='white', stroke_width=1, stroke_fill='black')
-    draw.text((bar_x-pilot_text_width-8*scale, bar_y + bar_height-altibar_pilot - textsize/2), pilot_text, font=font, fill='white', stroke_width=1, stroke_fill='black')
-    draw.text((bar_x+bar_width+8*scale, bar_y + bar_height-altibar_pilot + 3*arrow_height - textsize/2), vario_text, font=font, fill='white', stroke_width=1, stroke_fill='black')
+    # Draw arrow
+    arrow = [(-1,0), (1,0), (1,3), (2,3), (0,6), (-2,3), (-1,3)]
+    arrow_width = 8
+    arrow_x = bar_x + bar_width/2
+    arrow_y = bar_y + bar_height - altibar_pilot
+    scaled_arrow = [(arrow_x + px * arrow_width, arrow_y + py * arrow_height) for px, py in arrow]
+    draw.polygon(scaled_arrow, fill=(255, 40, 40, 220), outline ='black', width=round(2*scale))
+
+    # Draw pilot bar
+    draw.rectangle([bar_x, bar_y + bar_height - altibar_pilot - 3*scale, bar_x + bar_width, bar_y + bar_height - altibar_pilot + 3*scale], fill="red", outline ='black', width=round(2*scale))
+
+    # Find text positions
+    ground_text_width = get_text_length(ground_text, textsize)
+    pilot_text_width = get_text_length(pilot_text, textsize)
+
+    # Draw text (cached text tiles, only re-rendered when the string changes)
+    draw_text(image, (bar_x-ground_text_width-8*scale, bar_y + bar_height-altibar_ground - textsize/2), ground_text, textsize, 'white', stroke_width=1, stroke_fill='black')
+    draw_text(image, (bar_x-pilot_text_width-8*scale, bar_y + bar_height-altibar_pilot - textsize/2), pilot_text, textsize, 'white', stroke_width=1, stroke_fill='black')
+    draw_text(image, (bar_x+bar_width+8*scale, bar_y + bar_height-altibar_pilot + 3*arrow_height - textsize/2), vario_text, textsize, 'white', stroke_width=1, stroke_fill='black')
     
     return image
 
@@ -1,21 +1,15 @@
 import math
 from PIL import Image, ImageDraw, ImageFont
-import csv
-import json
-from datetime import datetime
+from functools import lru_cache
+from .layer_cache import get_font
 
 
-def make_goal_field(goal_type, track_point, width, height, res_scale, goal_text_reference): # Height should be 54-ish
+def get_goal_texts(goal_type, track_point, goal_text_reference):
     sl_distance = track_point["sl_distance"]
     open_distance = track_point["open_dist"]
     distance_3tp = track_point["3tp_dist"]
     target_distance = track_point["target_distance"]
 
-    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(image)
-    textsize = round(18*res_scale)
-    font = ImageFont.truetype("arial.ttf", textsize)
-    
     # Choose goal type
     if goal_type == '3tp_distance': 
         # 3tp-distance
@@ -33,6 +27,17 @@ def make_goal_field(goal_type, track_point, width, height, res_scale, goal_text_
         print('No goal declared')
         line1_text = ""
         line2_text = ""
+    return line1_text, line2_text
+
+
+@lru_cache(maxsize=64)
+def render_goal_field(line1_text, line2_text, width, height, res_scale):
+    # The field only depends on its two strings, so it is rendered once per string pair.
+    # Shared between frames: paste it, don't draw on it.
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    textsize = round(18*res_scale)
+    font = get_font(textsize)
 
     line1_text_width = draw.textlength(line1_text, font=font)
     line2_text_width = draw.textlength(line2_text, font=font)
@@ -46,31 +51,15 @@ def make_goal_field(goal_type, track_point, width, height, res_scale, goal_text_
     return image
 
 
+def make_goal_field(goal_type, track_point, width, height, res_scale, goal_text_reference): # Height should be 54-ish
+    line1_text, line2_text = get_goal_texts(goal_type, track_point, goal_text_reference)
+    return render_goal_field(line1_text, line2_text, width, height, res_scale)
+
+
 # Testing purposes:
 if __name__ == "__main__":
-    filename = 'track_points.csv'
-    # read track points
-    track_points = []
-    datetime_fields = ['local_time', 'timestamp']
-    with open(filename, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            for key, value in row.items():
-                try:
-                    # Try converting to float if possible
-                    row[key] = float(value)
-                except ValueError:
-                    # Check if it's a datetime field and convert
-                    if key in datetime_fields:
-                        row[key] = datetime.fromisoformat(value)
-                    else:
-                        # If conversion fails, check if it's a JSON string
-                        try:
-                            row[key] = json.loads(value)
-                        except json.JSONDecodeError:
-                            # If it's not JSON, leave it as the original string
-                            pass
-            track_points.append(row)
+    from processing_utils import load_track_points
+    track_points = load_track_points('track_points')
 
     track_point = track_points[int(len(track_points)*0.7)]
 
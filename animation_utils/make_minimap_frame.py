@@ -5,8 +5,7 @@ import subprocess
 import sys
 import time
 import csv
-from datetime import datetime
-import json
+from .layer_cache import get_font
 
 
 def get_ruler_km(map_km):
@@ -34,14 +33,14 @@ def initialize_minimap(track_point, no_maps, res_scale, width):
     y_offsets = []
     for i in range(0, no_maps):
         scale = 2 ** i
-        x_offsets.append(track_point["map_coordinate"][i]["x"] * scale - track_point["map_coordinate"][0]["x"])
-        y_offsets.append(track_point["map_coordinate"][i]["y"] * scale - track_point["map_coordinate"][0]["y"])
+        x_offsets.append(float(track_point["map_xy"][i, 0] * scale - track_point["map_xy"][0, 0]))
+        y_offsets.append(float(track_point["map_xy"][i, 1] * scale - track_point["map_xy"][0, 1]))
 
     # Initialize minmax pixel positions
-    x_pixels_min = track_point["map_coordinate"][0]["x"]
-    x_pixels_max = track_point["map_coordinate"][0]["x"]
-    y_pixels_min = track_point["map_coordinate"][0]["y"]
-    y_pixels_max = track_point["map_coordinate"][0]["y"]
+    x_pixels_min = float(track_point["map_xy"][0, 0])
+    x_pixels_max = float(track_point["map_xy"][0, 0])
+    y_pixels_min = float(track_point["map_xy"][0, 1])
+    y_pixels_max = float(track_point["map_xy"][0, 1])
 
     arrow = [(-8*res_scale,-6*res_scale), (8*res_scale,0), (-8*res_scale,6*res_scale)]
     center_factor = 0.3
@@ -67,8 +66,9 @@ def initialize_minimap(track_point, no_maps, res_scale, width):
 
 
 
-def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, track_point_prev, map_metadata, res_scale, width):
-    # Unpack memory dictionary
+def update_minimap(frame_memory, path_images, i, track_point, track_point_prev, res_scale):
+    # Draws the newest path segment on all maps and moves the frame center.
+    # Cheap compared to rendering, so it can also be used to fast-forward the minimap state.
     center_pilot_x = frame_memory['center_pilot_x']
     center_pilot_y = frame_memory['center_pilot_y']
     x_offsets = frame_memory['x_offsets']
@@ -77,21 +77,13 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
     x_pixels_max = frame_memory['x_pixels_max']
     y_pixels_min = frame_memory['y_pixels_min']
     y_pixels_max = frame_memory['y_pixels_max']
-    arrow = frame_memory['arrow']
     center_radius = frame_memory['center_radius']
-    target_arrow_base = frame_memory['target_arrow_base']
 
-    phi = track_point["direction"]
-    height = width
     path_linewidth = round(res_scale)
-    m_px = map_metadata[0][6]
-    no_maps = len(map_metadata)
+    no_maps = len(path_images)
+    xy = track_point["map_xy"].tolist() # [x, y] per map
+    xy_prev = track_point_prev["map_xy"].tolist() if i > 0 else None
 
-    # Initializes path drawing for all maps
-    draw = []
-    for p in range(0, no_maps):
-        draw.append(ImageDraw.Draw(path_images[p]))
-    
     # Draw path on all maps:
     x_pixel = []
     y_pixel = []
@@ -102,13 +94,13 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
     center_frame_x = []
     center_frame_y = []
     for p in range(0, no_maps):
-        x_pixel.append(track_point["map_coordinate"][p]["x"])
-        y_pixel.append(track_point["map_coordinate"][p]["y"])
+        x_pixel.append(xy[p][0])
+        y_pixel.append(xy[p][1])
         # Drawing path
         if i > 0:
-            x_pixel_last.append(track_point_prev["map_coordinate"][p]["x"])
-            y_pixel_last.append(track_point_prev["map_coordinate"][p]["y"])
-            draw[p].line((x_pixel_last[p], y_pixel_last[p], x_pixel[p], y_pixel[p]), fill='red', width=path_linewidth)
+            x_pixel_last.append(xy_prev[p][0])
+            y_pixel_last.append(xy_prev[p][1])
+            path_images[p].draw_line((x_pixel_last[p], y_pixel_last[p], x_pixel[p], y_pixel[p]), fill='red', width=path_linewidth)
 
     # Frame center pilot: 
     if i == 0: # center for first iteration
@@ -125,8 +117,8 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
             center_pilot_y[p] = (center_pilot_y[0] + y_offsets[p]) / (2 ** p)
     
     # Frame center path:
-    x = track_point["map_coordinate"][0]["x"]
-    y = track_point["map_coordinate"][0]["y"]
+    x = xy[0][0]
+    y = xy[0][1]
     # Find pixels traveled
     if x > x_pixels_max:
         x_pixels_max = x
@@ -148,24 +140,58 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
     for p in range(0, no_maps):
         center_frame_x.append(center_pilot_x[p] * (1 - track_point["fraction"]) + center_path_x[p] * track_point["fraction"])
         center_frame_y.append(center_pilot_y[p] * (1 - track_point["fraction"]) + center_path_y[p] * track_point["fraction"])
+
+    # Save memory for next iteration
+    frame_memory['center_pilot_x'] = center_pilot_x
+    frame_memory['center_pilot_y'] = center_pilot_y
+    frame_memory['x_pixels_min'] = x_pixels_min
+    frame_memory['x_pixels_max'] = x_pixels_max
+    frame_memory['y_pixels_min'] = y_pixels_min
+    frame_memory['y_pixels_max'] = y_pixels_max
+    # Save view of current frame for rendering
+    frame_memory['x_pixel'] = x_pixel
+    frame_memory['y_pixel'] = y_pixel
+    frame_memory['center_frame_x'] = center_frame_x
+    frame_memory['center_frame_y'] = center_frame_y
+
+    return path_images, frame_memory
+
+
+def render_minimap(frame_memory, path_images, i, no_points, track_point, map_metadata, res_scale, width):
+    # Renders the minimap frame from the state left by update_minimap
+    x_pixel = frame_memory['x_pixel']
+    y_pixel = frame_memory['y_pixel']
+    center_frame_x = frame_memory['center_frame_x']
+    center_frame_y = frame_memory['center_frame_y']
+    arrow = frame_memory['arrow']
+    target_arrow_base = frame_memory['target_arrow_base']
+
+    phi = track_point["direction"]
+    height = width
+    m_px = map_metadata[0][6]
     
     # Choose appropriate sized map
     map_number = int(track_point["zoom_level"]) # rounds down
 
+    # Crop first, so only the visible window is copied from the path image
+    temp_width = width * 2**track_point["zoom_level"] / 2**map_number
+    crop_box = (center_frame_x[map_number] - temp_width/2.0, center_frame_y[map_number] - temp_width/2.0, center_frame_x[map_number] + temp_width/2.0, center_frame_y[map_number] + temp_width/2.0)
+    cropped_image = path_images[map_number].crop(crop_box)
+    # Pilot position in crop coordinates (crop rounds the box to whole pixels)
+    x_local = x_pixel[map_number] - round(crop_box[0])
+    y_local = y_pixel[map_number] - round(crop_box[1])
+
     # Draws arrow at the end of path (but doesnt mess with path_images) 
-    image_with_arrow = path_images[map_number].copy()
-    draw2 = ImageDraw.Draw(image_with_arrow)
-    angled_arrow = [(x_pixel[map_number] + px * math.cos(phi) - py * math.sin(phi), y_pixel[map_number] + px * math.sin(phi) + py * math.cos(phi)) for px, py in arrow]
+    draw2 = ImageDraw.Draw(cropped_image)
+    angled_arrow = [(x_local + px * math.cos(phi) - py * math.sin(phi), y_local + px * math.sin(phi) + py * math.cos(phi)) for px, py in arrow]
     if i == 0 or i == no_points-1:
         dot_radius = 6*res_scale
-        pilot_dot = [x_pixel[map_number]-dot_radius, y_pixel[map_number]-dot_radius, x_pixel[map_number]+dot_radius, y_pixel[map_number]+dot_radius]
+        pilot_dot = [x_local-dot_radius, y_local-dot_radius, x_local+dot_radius, y_local+dot_radius]
         draw2.ellipse(pilot_dot, fill='red', outline ='black')
     else:
         draw2.polygon(angled_arrow, fill='red', outline ='black', width = round(2*res_scale))
 
-    # Crop and scale
-    temp_width = width * 2**track_point["zoom_level"] / 2**map_number
-    cropped_image = image_with_arrow.crop((center_frame_x[map_number] - temp_width/2.0, center_frame_y[map_number] - temp_width/2.0, center_frame_x[map_number] + temp_width/2.0, center_frame_y[map_number] + temp_width/2.0))
+    # Scale
     cropped_image = cropped_image.resize((width, width))
     draw3 = ImageDraw.Draw(cropped_image)
 
@@ -174,7 +200,7 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
     ruler_km = get_ruler_km(width * m_px2 / 1000)
     ruler_pixels = ruler_km * 1000 / m_px2
     ruler_text = f"{ruler_km} km"
-    font = ImageFont.truetype("arial.ttf", size=round(14*res_scale))
+    font = get_font(round(14*res_scale))
 
     draw3.line((width-8*res_scale, height-14*res_scale, width-8*res_scale, height-8*res_scale), fill='white', width=round(res_scale))
     draw3.line((width-8*res_scale, height-8*res_scale, width-8*res_scale-ruler_pixels, height-8*res_scale), fill='white', width=round(res_scale))
@@ -198,7 +224,7 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
             draw3.polygon(target_arrow, fill='green', outline ='black', width = round(2*res_scale))
             # draw target text
             target_text = f'{round(track_point["target_distance"]/1000)} km'
-            font = ImageFont.truetype("arial.ttf", size=round(18*res_scale))
+            font = get_font(round(18*res_scale))
             bbox = draw3.textbbox((0, 0), target_text, font=font)
             text_width = bbox[2] - bbox[0]
             text_height = bbox[3] - bbox[1]
@@ -208,55 +234,61 @@ def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, tra
 
     cropped_image = cropped_image.convert("RGBA")
 
-    # Save memory for next iteration
-    frame_memory['center_pilot_x'] = center_pilot_x
-    frame_memory['center_pilot_y'] = center_pilot_y
-    frame_memory['x_offsets'] = x_offsets
-    frame_memory['y_offsets'] = y_offsets
-    frame_memory['x_pixels_min'] = x_pixels_min
-    frame_memory['x_pixels_max'] = x_pixels_max
-    frame_memory['y_pixels_min'] = y_pixels_min
-    frame_memory['y_pixels_max'] = y_pixels_max
-    frame_memory['arrow'] = arrow
-    frame_memory['center_radius'] = center_radius
-    frame_memory['target_arrow_base'] = target_arrow_base
+    return cropped_image
+
+
+def get_minimap_key(frame_memory, i, no_points, track_point, track_point_prev, map_metadata, width):
+    # Cheap summary of what render_minimap would draw, rounded to whole pixels. The path
+    # segment drawn for this frame is included, so a growing path is never skipped.
+    map_number = int(track_point["zoom_level"])
+    segment = None
+    if i > 0:
+        segment = (
+            round(float(track_point_prev["map_xy"][map_number, 0]), 1),
+            round(float(track_point_prev["map_xy"][map_number, 1]), 1),
+            round(float(track_point["map_xy"][map_number, 0]), 1),
+            round(float(track_point["map_xy"][map_number, 1]), 1),
+        )
+    temp_width = width * 2**track_point["zoom_level"] / 2**map_number
+    x_crop = round(frame_memory['center_frame_x'][map_number] - temp_width/2.0)
+    y_crop = round(frame_memory['center_frame_y'][map_number] - temp_width/2.0)
+    target_text = None
+    if map_metadata[map_number][7] != None:
+        target_text = round(track_point["target_distance"]/1000)
+    minimap_key = (
+        map_number,
+        round(temp_width, 1),
+        x_crop,
+        y_crop,
+        round(frame_memory['x_pixel'][map_number] - x_crop),
+        round(frame_memory['y_pixel'][map_number] - y_crop),
+        round(math.degrees(track_point["direction"])),
+        i == 0 or i == no_points-1,
+        target_text,
+        segment,
+    )
+    return minimap_key
 
+
+def make_minimap_frame(frame_memory, path_images, i, no_points, track_point, track_point_prev, map_metadata, res_scale, width):
+    path_images, frame_memory = update_minimap(frame_memory, path_images, i, track_point, track_point_prev, res_scale)
+    cropped_image = render_minimap(frame_memory, path_images, i, no_points, track_point, map_metadata, res_scale, width)
     return cropped_image, path_images, frame_memory
 
 
     
 # Testing purposes:
 if __name__ == "__main__":
-    filename = 'track_points.csv'
-    # read track points
-    track_points = []
-    datetime_fields = ['local_time', 'timestamp']
-    with open(filename, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            for key, value in row.items():
-                try:
-                    # Try converting to float if possible
-                    row[key] = float(value)
-                except ValueError:
-                    # Check if it's a datetime field and convert
-                    if key in datetime_fields:
-                        row[key] = datetime.fromisoformat(value)
-                    else:
-                        # If conversion fails, check if it's a JSON string
-                        try:
-                            row[key] = json.loads(value)
-                        except json.JSONDecodeError:
-                            # If it's not JSON, leave it as the original string
-                            pass
-            track_points.append(row)
+    from map_utils import load_mosaic
+    from processing_utils import load_track_points
+    track_points = load_track_points('track_points')
 
     # Read maps
-    no_maps = len(track_points[0]["map_coordinate"])
+    no_maps = track_points["map_xy"].shape[1]
     print("number of maps: ",  no_maps)
     map_images = []
     for k in range(0, no_maps):
-        map_image = Image.open(f"media/map_stitched{k}.png").convert("RGB")
+        map_image = load_mosaic(f"media/map_mosaic{k}.pickle")
         map_images.append(map_image)
 
     # Read minimap metadata
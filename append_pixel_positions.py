@@ -1,39 +1,13 @@
-import math
+from map_utils import layer_affines, project_layers
 
 def append_pixel_positions(track_points, map_metadata, outline_metadata):
     print("Calculating path pixels on maps...")
-    for i in range(0, len(track_points)):
-        lat = track_points[i]["lat"]
-        lon = track_points[i]["lon"]
-
-        # Outline
-        lon_min_out, lat_min_out, lon_max_out, lat_max_out, width_out, height_out = outline_metadata
-
-        x_pixels = (lon - lon_min_out)/(lon_max_out - lon_min_out) * width_out
-        
-        yp = math.log(math.tan(math.pi/4 + lat/360*math.pi))
-        y_bottom = math.log(math.tan(math.pi/4 + lat_min_out/360*math.pi))
-        y_top = math.log(math.tan(math.pi/4 + lat_max_out/360*math.pi))
-        y_pixels = (y_top - yp)/(y_top - y_bottom) * height_out
-        
-        track_points[i]["outline_x"] = x_pixels
-        track_points[i]["outline_y"] = y_pixels
-
-        # Mini-map
-        track_points[i]["map_coordinate"] = []
-        for metadata_zoom in map_metadata:
-            lon_min, lat_min, lon_max, lat_max, width, height, *_ = metadata_zoom
-
-            x_pixels = (lon - lon_min)/(lon_max - lon_min) * width
-            
-            yp = math.log(math.tan(math.pi/4 + lat/360*math.pi))
-            y_bottom = math.log(math.tan(math.pi/4 + lat_min/360*math.pi))
-            y_top = math.log(math.tan(math.pi/4 + lat_max/360*math.pi))
-            y_pixels = (y_top - yp)/(y_top - y_bottom) * height
-            
-            track_points[i]["map_coordinate"].append({"x": x_pixels, "y": y_pixels})
-
-        
+    # One projection for all mini-map zoom levels and the outline (last layer).
+    # The columns are views into the same (n_points, n_layers, 2) array.
+    bounds = [metadata_zoom[:6] for metadata_zoom in map_metadata] + [outline_metadata]
+    pixel_xy = project_layers(track_points["lat"], track_points["lon"], layer_affines(bounds))
+    track_points["map_xy"] = pixel_xy[:, :-1] # Mini-map, one (x, y) per zoom level
+    track_points["outline_x"] = pixel_xy[:, -1, 0]
+    track_points["outline_y"] = pixel_xy[:, -1, 1]
 
     return track_points
-
@@ -1,91 +1,96 @@
 import math
+import numpy as np
 
-def append_zoom_levels(track_points, map_width, fps):
-    # Goal is to make graph zoom level VS time
-    print("Calculating zoom levels...")
-    t1 = 60
-    t2 = 1
-    t3 = 8
-    t4 = 1
-    t5 = 10
-    t_total = len(track_points) / fps
+# When the minimap zooms out to show the whole track so far. Segments are
+# (name, seconds, fraction at the end); fraction goes linearly from the previous value,
+# 0 is the small map and 1 is zoomed out to the track.
+zoom_schedule = {
+    'lead_in': 60, # Small map after the track outgrows it, before the first cycle
+    'cycle': [ # Repeated while there is time for a whole cycle before the ending
+        ('zoom out', 1, 1),
+        ('big map', 8, 1),
+        ('zoom in', 1, 0),
+        ('small map', 60, 0),
+    ],
+    'ending': [ # Last seconds of the animation
+        ('zoom out', 1, 1),
+        ('big map', 10, 1),
+    ],
+}
+
+
+def get_zoom_level(pixels_traveled, map_width, no_maps):
+    # Smallest map level that fits the extent, for one value or an array
+    padding = 40
+    scale = (np.asarray(pixels_traveled) + padding) / map_width
+    return np.clip(np.ceil(np.log2(np.maximum(1, scale))), 0, no_maps - 1)
+
+
+def zoom_timeline(pixel_distance_line, map_width, fps, no_maps, schedule=zoom_schedule):
+    # Keyframes (frame, fraction, zoom_level); values in between are linear
+    no_points = len(pixel_distance_line)
+    t_total = no_points / fps
+    cycle = schedule['cycle']
+    ending = schedule['ending']
+    t_cycle = sum(seconds for _, seconds, _ in cycle)
+    t_ending = sum(seconds for _, seconds, _ in ending)
 
     # Define t0; start time where distance traveled is so long that we need zoom:
-    t0 = t_total
-    x_pixels_min = track_points[0]["map_coordinate"][0]["x"]
-    x_pixels_max = track_points[0]["map_coordinate"][0]["x"]
-    y_pixels_min = track_points[0]["map_coordinate"][0]["y"]
-    y_pixels_max = track_points[0]["map_coordinate"][0]["y"]
-    for i in range(0, len(track_points)):
-        x = track_points[i]["map_coordinate"][0]["x"]
-        y = track_points[i]["map_coordinate"][0]["y"]
-        # Find pixels traveled
-        if x > x_pixels_max:
-            x_pixels_max = x
-        elif x < x_pixels_min:
-            x_pixels_min = x
-        if y > y_pixels_max:
-            y_pixels_max = y
-        elif y < y_pixels_min:
-            y_pixels_min = y
-        pixels_traveled = max(x_pixels_max-x_pixels_min, y_pixels_max-y_pixels_min)
-        track_points[i]["pixel_distance_line"] = pixels_traveled
-        if pixels_traveled > 0.6 * map_width and t0 == t_total:
-            t0 = round(i / fps)
+    needs_zoom = np.flatnonzero(pixel_distance_line > 0.6 * map_width)
+    t0 = round(needs_zoom[0] / fps) if len(needs_zoom) > 0 else t_total
 
     # Find key times
-    tx = t_total - t0 - t1 - t5 - t2
-    n = max(0, math.floor(tx / (t2 + t3 + t4 + t1)))
-    no_maps = len(track_points[0]["map_coordinate"])
+    tx = t_total - t0 - schedule['lead_in'] - t_ending
+    n = max(0, math.floor(tx / t_cycle))
     print(f"n: {n}, t_tot = {t_total}, t0 = {t0}, tx = {tx}, no_maps = {no_maps}")
-    padding = 40
 
-    # ALLOCATE ZOOM FRACTIONS
-    # All values
-    for point in track_points:
-        point["fraction"] = 0
-        point["zoom_level"] = 0
+    # Each cycle zooms out as far as the track reaches when its zoom in ends
+    ends = np.cumsum([seconds for _, seconds, _ in cycle])
+    fractions_start = [0] + [end_fraction for _, _, end_fraction in cycle[:-1]]
+    last_zoomed = max(k for k, (_, _, end_fraction) in enumerate(cycle) if end_fraction > 0 or fractions_start[k] > 0)
+    starts = t0 + schedule['lead_in'] + np.arange(n) * t_cycle
+    i_level = (fps * (starts + ends[last_zoomed])).astype(int)
+    cycle_levels = get_zoom_level(pixel_distance_line[i_level], map_width, no_maps)
 
-    # Last values
-    scale = (track_points[-1]["pixel_distance_line"] + padding) / map_width
-    zoom_level = min(max(math.ceil(math.log2(max(1,scale))), 0), no_maps-1)
-    for i in range(0, min(len(track_points), int(fps * t5))): # Last big map
-        track_points[-1 - i]["fraction"] = 1
-        track_points[-1 - i]["zoom_level"] = zoom_level
-    if len(track_points) > int(fps * (t5 + t2)):
-        for i in range(0, int(fps * t2)): # last zoom out
-            j = len(track_points) - int(fps * (t5 + t2)) + i
-            track_points[j]["fraction"] = i / (fps * t2)
-            track_points[j]["zoom_level"] = track_points[j]["fraction"] * zoom_level
-    else: # super short tracklog
-        for point in track_points:
-            point["fraction"] = 1
-            point["zoom_level"] = zoom_level
-    
-    # Values every cycle
-    for p in range(0, n):
-        i_crit = int(fps * (t0 + (p + 1) * (t1 + t2 + t3 + t4)))
-        scale = (track_points[i_crit]["pixel_distance_line"] + padding) / map_width
-        zoom_level = min(max(math.ceil(math.log2(max(1,scale))), 0), no_maps-1)
-        print(p, scale, zoom_level)
-        for i in range(0, int(fps * (t2 + t3 + t4 + t1))):
-            j = int(fps * (t0 + t1 + p*(t2 + t3 + t4 + t1))) + i
-            if i < int(fps * t2): # zoom out
-                track_points[j]["fraction"] = i / (fps * t2)
-                track_points[j]["zoom_level"] = track_points[j]["fraction"] * zoom_level
-            elif i < int(fps * (t2 + t3)): # big map
-                track_points[j]["fraction"] = 1
-                track_points[j]["zoom_level"] = zoom_level
-            elif i < int(fps * (t2 + t3 + t4)): # zoom in
-                track_points[j]["fraction"] = 1 - (i - fps * (t2 + t3)) / (fps * t4)
-                track_points[j]["zoom_level"] = track_points[j]["fraction"] * zoom_level
-            else: # small map
-                track_points[j]["fraction"] = 0
-                track_points[j]["zoom_level"] = 0
+    keyframes = [(0, 0, 0)]
+    for start, zoom_level in zip(starts.tolist(), cycle_levels.tolist()):
+        frame = int(fps * start)
+        keyframes.append((frame, 0, 0))
+        for (_, _, fraction), end in zip(cycle, ends.tolist()):
+            keyframes.append((frame + int(fps * end), fraction, fraction * zoom_level))
 
+    # Ending, zoomed out to the whole track
+    zoom_level = get_zoom_level(pixel_distance_line[-1], map_width, no_maps).item()
+    if no_points > int(fps * t_ending):
+        frame = no_points - int(fps * t_ending)
+        keyframes.append((frame, 0, 0))
+        for (_, _, fraction), end in zip(ending, np.cumsum([seconds for _, seconds, _ in ending]).tolist()):
+            keyframes.append((frame + int(fps * end), fraction, fraction * zoom_level))
+    else: # super short tracklog
+        keyframes = [(0, 1, zoom_level)]
 
-    return track_points
+    # Frames must increase; where cycles meet, the same frame appears twice with the same values
+    keyframes = np.array(keyframes, dtype=float)
+    keep = np.concatenate(([True], keyframes[1:, 0] > np.maximum.accumulate(keyframes[:-1, 0])))
+    return keyframes[keep]
 
 
+def append_zoom_levels(track_points, map_width, fps, schedule=zoom_schedule):
+    # Goal is to make graph zoom level VS time
+    print("Calculating zoom levels...")
+    map_x = track_points["map_xy"][:, 0, 0]
+    map_y = track_points["map_xy"][:, 0, 1]
+    # Pixels traveled: largest side of the bounding box of the track so far
+    x_extent = np.maximum.accumulate(map_x) - np.minimum.accumulate(map_x)
+    y_extent = np.maximum.accumulate(map_y) - np.minimum.accumulate(map_y)
+    pixel_distance_line = np.maximum(x_extent, y_extent)
+    track_points["pixel_distance_line"] = pixel_distance_line
 
+    # One value per frame, so the renderer looks them up directly
+    no_maps = track_points["map_xy"].shape[1]
+    keyframes = zoom_timeline(pixel_distance_line, map_width, fps, no_maps, schedule)
+    frames = np.arange(len(track_points))
+    track_points["fraction"] = np.interp(frames, keyframes[:, 0], keyframes[:, 1])
+    track_points["zoom_level"] = np.interp(frames, keyframes[:, 0], keyframes[:, 2])
 
+    return track_points
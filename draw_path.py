@@ -1,21 +1,23 @@
-from PIL import ImageDraw
+preview_max_pixels = 2048 * 2048 # Size cap of the preview, so memory doesn't grow with the flight
 
 def draw_path(map_images, track_points):
 
-    # Create a drawing object
-    path_image = map_images[0].copy()
-    draw = ImageDraw.Draw(path_image)
+    # Draw on a copy of the most detailed map that fits the preview size (each level is
+    # half the size of the one before, the last one always fits the animation)
+    level = len(map_images) - 1
+    for i, map_image in enumerate(map_images):
+        if map_image.size[0] * map_image.size[1] <= preview_max_pixels:
+            level = i
+            break
+    path_image = map_images[level].copy()
 
     print("Drawing path on map for fun...")
-    for i in range(0, len(track_points)):        
-        x = track_points[i]["map_coordinate"][0]["x"]
-        y = track_points[i]["map_coordinate"][0]["y"]
-        if i > 0:
-            draw.line((last_x, last_y, x, y), fill='red', width=2)
-        last_x, last_y = x, y
-    
+    xy = track_points["map_xy"][:, level].tolist()
+    for i in range(1, len(xy)):
+        path_image.draw_line((xy[i - 1][0], xy[i - 1][1], xy[i][0], xy[i][1]), fill='red', width=2)
+
     # Save and return the new image
-    path_image.save('media/map_with_path.png')
+    path_image.to_image().save('media/map_with_path.png')
     print("Made map with path")
-    
+
     return
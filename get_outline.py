@@ -1,50 +1,38 @@
-import geopandas as gpd
-from shapely.geometry import box, Point, Polygon, MultiPolygon
-from shapely.ops import unary_union, transform
+import shapely
+from shapely.ops import unary_union
 from PIL import Image, ImageDraw
 import pyproj
 import math
 import sys
+import os
+import json
+import hashlib
+import numpy as np
+from map_utils import get_country_store
+
+outline_cache_dir = 'outline_cache'
+outline_cache_version = 2
 
 # Fundtion finds bounding coordinates on country/island from coordinate list
 def get_bounding_coordinates(coords):
-    world_gdf = gpd.read_file("countries.geojson")
-    track_gdf = gpd.GeoDataFrame(geometry=[Point(coord[1], coord[0]) for coord in coords])
-    track_gdf.crs = "EPSG:4326"
-    
-    # Decompose MultiPolygons into individual polygons and include country name
-    all_polygons = []
-    country_names = []
-    for _, row in world_gdf.iterrows():
-        geom = row.geometry
-        admin = row['ADMIN']
-        if isinstance(geom, Polygon):
-            all_polygons.append(geom)
-            country_names.append(admin)
-        elif isinstance(geom, MultiPolygon):
-            for sub_geom in geom.geoms:
-                all_polygons.append(sub_geom)
-                country_names.append(admin)
-    
-    decomposed_gdf = gpd.GeoDataFrame({'geometry': all_polygons, 'ADMIN': country_names}, crs=world_gdf.crs)
-    
-    # Perform the spatial join
-    joined = gpd.sjoin(track_gdf, decomposed_gdf, how="inner", predicate="within")
+    store = get_country_store()
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    polygon_index = store.polygons_containing(coords[:, 0], coords[:, 1])
 
     # Create a dictionary to count intersecting polygons per country
     country_dict = {}
-    for index in joined.index_right.unique():
-        country_name = decomposed_gdf.loc[index, 'ADMIN']  # Now we use decomposed_gdf
+    for index in polygon_index.tolist():
+        country_name = store.countries[store.polygon_country[index]]
         country_dict[country_name] = country_dict.get(country_name, 0) + 1
 
     # Combine the polygons into one
-    combined_polygon = unary_union([decomposed_gdf.loc[index, 'geometry'] for index in joined.index_right.unique()])
+    combined_polygon = unary_union(list(store.polygons[polygon_index]))
 
     # Check for mainland Norway exception
     if 'Norway' in country_dict:
         print("Inside Norway")
-        lat_min = min(coords, key=lambda x: x[0])[0]
-        lat_max = max(coords, key=lambda x: x[0])[0]
+        lat_min = coords[:, 0].min()
+        lat_max = coords[:, 0].max()
         if lat_min >= 57.9 and lat_max <= 63.9:
             print("Southern Norway")
             norway_bbox = (4.5, 57.9, 14.2, 64)
@@ -54,65 +42,34 @@ def get_bounding_coordinates(coords):
 
 
 def find_countries(lon_min, lat_min, lon_max, lat_max):
-    # Load the GeoJSON file into a GeoDataFrame
-    world_gdf = gpd.read_file("countries.geojson")
-
-    # Reproject to a CRS that allows for area calculation (equal-area projection)
-    world_gdf = world_gdf.to_crs('EPSG:6933')  # EPSG:6933 is an equal-area projection
-
-    bbox = box(lon_min, lat_min, lon_max, lat_max)
-    project = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:6933", always_xy=True).transform
-    bbox = transform(project, bbox)
-
-    # Transformer to convert back to WGS84
-    project_back = pyproj.Transformer.from_crs("EPSG:6933", "EPSG:4326", always_xy=True).transform
+    store = get_country_store()
 
     # Dictionary to store information about countries
     polygon_dict = {}
-    for _, row in world_gdf.iterrows():
-        geom = row['geometry']
-        admin = row['ADMIN']  # Country name
-        if isinstance(geom, MultiPolygon) or isinstance(geom, Polygon):
-            geoms_to_check = geom.geoms if isinstance(geom, MultiPolygon) else [geom]
-            for poly in geoms_to_check:
-                if poly.intersects(bbox):
-                    # Get the centroid of the intersecting polygon in the 6933 projection
-                    centroid = poly.representative_point()  # Use 'poly' instead of 'geom'
-                    lon, lat = project_back(centroid.x, centroid.y)
-                    area = poly.area / 10**6  # Convert area from square meters to square kilometers
-                    if admin not in polygon_dict:
-                        polygon_dict[admin] = {'count': 0, 'points': [], 'areas': []}
-                    # Update country information
-                    polygon_dict[admin]['count'] += 1
-                    polygon_dict[admin]['points'].append((lat, lon))
-                    polygon_dict[admin]['areas'].append(area)
+    for index in store.polygons_in_box(lon_min, lat_min, lon_max, lat_max).tolist():
+        admin = store.countries[store.polygon_country[index]]  # Country name
+        lat, lon = store.points[index].tolist() # Representative point, found in the equal-area projection
+        if admin not in polygon_dict:
+            polygon_dict[admin] = {'count': 0, 'points': [], 'areas': []}
+        # Update country information
+        polygon_dict[admin]['count'] += 1
+        polygon_dict[admin]['points'].append((lat, lon))
+        polygon_dict[admin]['areas'].append(float(store.areas[index])) # Square kilometers
 
     return polygon_dict
 
 
 # Function saves section of map from bounding coordinates
 def get_borders(lat_min, lat_max, lon_min, lon_max, width, height_max):
+    # Countries that intersect with the bounding box
+    geoms_to_draw = get_country_store().countries_in_box(lon_min, lat_min, lon_max, lat_max)
 
-    bbox = box(lon_min, lat_min, lon_max, lat_max)
-    # Load GeoJSON of World Countries
-    world_gdf = gpd.read_file("countries.geojson")
-    
-    # Filter geometries that intersect with the bounding box and clip them
-    geoms_to_draw = []
-    for _, row in world_gdf.iterrows():
-        if row.geometry.within(bbox) or row.geometry.intersects(bbox):
-            geoms_to_draw.append(row.geometry)
-    
-    # Convert geoms_to_draw to Mercator and create a GeoDataFrame
-    gdf_to_draw = gpd.GeoDataFrame(geometry=geoms_to_draw)
-    gdf_to_draw.crs = world_gdf.crs  # Set the CRS to match world_gdf
-    gdf_to_draw = gdf_to_draw.to_crs(epsg=3395)
+    project = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:3395", always_xy=True)
+    project_inverse = pyproj.Transformer.from_crs("EPSG:3395", "EPSG:4326", always_xy=True)
 
     # Calculate scaling factors
-    # Convert a geometry from one CRS to another
-    project = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:3395", always_xy=True).transform
-    bbox_mercator = transform(project, bbox) # Convert the bounding box to Mercator
-    bbox_minx, bbox_miny, bbox_maxx, bbox_maxy = bbox_mercator.bounds
+    # Mercator is separable, so the corners give the bounding box in Mercator
+    (bbox_minx, bbox_maxx), (bbox_miny, bbox_maxy) = project.transform([lon_min, lon_max], [lat_min, lat_max])
 
     height = width * (bbox_maxy - bbox_miny) / (bbox_maxx - bbox_minx)
     height = min(int(height+1), height_max)
@@ -126,46 +83,63 @@ def get_borders(lat_min, lat_max, lon_min, lon_max, width, height_max):
     bbox2_xmin = (bbox_maxx + bbox_minx - scale * width) / 2
     bbox2_ymax = (bbox_maxy + bbox_miny + scale * height) / 2
     bbox2_ymin = (bbox_maxy + bbox_miny - scale * height) / 2
-    project_inverse = pyproj.Transformer.from_crs("EPSG:3395", "EPSG:4326", always_xy=True).transform
-    adjusted_bbox = transform(project_inverse, box(bbox2_xmin, bbox2_ymin, bbox2_xmax, bbox2_ymax))
-    lon_min, lat_min, lon_max, lat_max = adjusted_bbox.bounds
+    (lon_min, lon_max), (lat_min, lat_max) = project_inverse.transform([bbox2_xmin, bbox2_xmax], [bbox2_ymin, bbox2_ymax])
+
+    # Level of detail: only the part of the countries in the image (plus a margin, so the
+    # edges made by clipping are outside the image), with details smaller than half a pixel
+    # removed. Clipping in degrees is exact, rectangles stay rectangles in Mercator.
+    margin = 4 * scale
+    (clip_lon_min, clip_lon_max), (clip_lat_min, clip_lat_max) = project_inverse.transform(
+        [bbox2_xmin - margin, bbox2_xmax + margin], [max(bbox2_ymin - margin, -20037508), min(bbox2_ymax + margin, 20037508)])
+    # Half a pixel in degrees; Mercator stretches latitudes most at the edge nearest the pole
+    max_lat = min(max(abs(clip_lat_min), abs(clip_lat_max)), 85)
+    tolerance = 0.5 * scale / (6378137 * math.pi / 180) * math.cos(max_lat / 180 * math.pi)
+
+    geoms_to_draw = shapely.clip_by_rect(geoms_to_draw, clip_lon_min, clip_lat_min, clip_lon_max, clip_lat_max)
+    polygons = shapely.get_parts(geoms_to_draw)
+    polygons = polygons[shapely.get_type_id(polygons) == 3] # Polygon
+    # Only the outlines are drawn. Simplified as lines, tiny islands still leave a dot.
+    rings = shapely.simplify(shapely.get_exterior_ring(polygons), tolerance, preserve_topology=False)
+
+    # All vertices projected and normalized to pixels at once
+    lonlat, ring_index = shapely.get_coordinates(rings, return_index=True)
+    x, y = project.transform(lonlat[:, 0], lonlat[:, 1])
+    xy = np.column_stack(((np.asarray(x) - bbox2_xmin) / scale, height - (np.asarray(y) - bbox2_ymin) / scale))
 
     # Initialize the image
     img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
 
-    # Draw each geometry on the image with normalized coordinates
-    for geom in gdf_to_draw.geometry:
-        if isinstance(geom, Polygon):
-            x, y = geom.exterior.xy
-            normalized_x = [(i - bbox2_xmin) / scale for i in x]
-            normalized_y = [height - (i - bbox2_ymin) / scale for i in y]
-            draw.polygon(list(zip(normalized_x, normalized_y)), fill=None, outline=(255, 255, 255, 255))
-        elif isinstance(geom, MultiPolygon):
-            for poly in geom.geoms:
-                x, y = poly.exterior.xy
-                normalized_x = [(i - bbox2_xmin) / scale for i in x]
-                normalized_y = [height - (i - bbox2_ymin) / scale for i in y]
-                draw.polygon(list(zip(normalized_x, normalized_y)), fill=None, outline=(255, 255, 255, 255))
-
-    return (img, adjusted_bbox.bounds, height)
+    # Draw each ring on the image
+    for ring_xy in np.split(xy, np.flatnonzero(np.diff(ring_index)) + 1):
+        if len(ring_xy) > 1:
+            draw.polygon(ring_xy.ravel().tolist(), fill=None, outline=(255, 255, 255, 255))
 
-def get_outline(track_points, anim_width, anim_height):
-    height_max = anim_height * 0.85 - anim_width
-    #width = round(width * 0.5) # scaling down outline image
-    width = 190 # good linewidth/size ratio
-    scale = anim_width / width / 2
+    return (img, (lon_min, lat_min, lon_max, lat_max), height)
 
+def get_outline(track_points, anim_width, anim_height):
     # Simplify tracklog
     timeinterval = 120
-    current_time = track_points[0]["timestamp"]
+    timestamps = track_points["timestamp"]
+    seconds = ((timestamps - timestamps[0]) / np.timedelta64(1, 's')).tolist()
+    lats = track_points["lat"].tolist()
+    lons = track_points["lon"].tolist()
+    current_time = 0
     coords = []
-    for point in track_points:
-        if (point["timestamp"] - current_time).total_seconds() > timeinterval:
-            current_time = point["timestamp"]
-            coords.append((point["lat"], point["lon"]))
+    for i in range(len(seconds)):
+        if seconds[i] - current_time > timeinterval:
+            current_time = seconds[i]
+            coords.append((lats[i], lons[i]))
 
     print("Finding country...")
+    bounds, countries = find_outline_bounds(coords)
+    return render_outline(bounds, countries, anim_width, anim_height)
+
+
+# Bounding box of the outline map: the country or island flown over, with nearby islands
+# and large land areas of the same country, plus padding
+def find_outline_bounds(coords):
+    coords = list(coords)
     bounds, countries = get_bounding_coordinates(coords)
     lon_min, lat_min, lon_max, lat_max = bounds
 
@@ -256,22 +230,70 @@ def get_outline(track_points, anim_width, anim_height):
     lon_max = lon_max + (lon_max - lon_min) * padding_percentage / 100
     lat_min = lat_min - (lat_max - lat_min) * padding_percentage / 100
     lat_max = lat_max + (lat_max - lat_min) * padding_percentage / 100
-    
-    print("Generating country outline...")
-    outline_image, bounding_coords, height = get_borders(lat_min, lat_max, lon_min, lon_max, width, height_max)
-    width = round(outline_image.size[0] * scale)
-    height = round(outline_image.size[1] * scale)
-    new_size = (width, height)
-    outline_image = outline_image.resize(new_size, Image.Resampling.LANCZOS)
-    lon_min, lat_min, lon_max, lat_max = bounding_coords
-    outline_image.save("media/country_outline.png")
-    print("Saved country map")
-    
-    outline_metadata = [lon_min, lat_min, lon_max, lat_max, width, height]
 
-    return(outline_image, outline_metadata)
+    return [lon_min, lat_min, lon_max, lat_max], countries
+
 
+# Outline image and metadata for a bounding box, from the outline cache when the same box,
+# countries and size have been rendered before
+def render_outline(bounds, countries, anim_width, anim_height, cache_dir=outline_cache_dir, save_path="media/country_outline.png"):
+    height_max = anim_height * 0.85 - anim_width
+    #width = round(width * 0.5) # scaling down outline image
+    width = 190 # good linewidth/size ratio
+    scale = anim_width / width / 2
+    lon_min, lat_min, lon_max, lat_max = bounds
 
+    key = outline_key(bounds, countries, anim_width, anim_height)
+    image_path = os.path.join(cache_dir, f"{key}.png")
+    metadata_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(image_path) and os.path.exists(metadata_path):
+        print("Using cached country outline")
+        with open(metadata_path) as f:
+            outline_metadata = json.load(f)
+        with Image.open(image_path) as image:
+            outline_image = image.copy()
+    else:
+        print("Generating country outline...")
+        outline_image, bounding_coords, height = get_borders(lat_min, lat_max, lon_min, lon_max, width, height_max)
+        width = round(outline_image.size[0] * scale)
+        height = round(outline_image.size[1] * scale)
+        new_size = (width, height)
+        outline_image = outline_image.resize(new_size, Image.Resampling.LANCZOS)
+        lon_min, lat_min, lon_max, lat_max = bounding_coords
+        outline_metadata = [lon_min, lat_min, lon_max, lat_max, width, height]
+
+        # Image first, the metadata file marks a complete entry
+        os.makedirs(cache_dir, exist_ok=True)
+        outline_image.save(f"{image_path}.part", format="PNG")
+        os.replace(f"{image_path}.part", image_path)
+        with open(f"{metadata_path}.part", 'w') as f:
+            json.dump(outline_metadata, f)
+        os.replace(f"{metadata_path}.part", metadata_path)
+
+    if save_path is not None:
+        outline_image.save(save_path)
+        print("Saved country map")
 
+    return(outline_image, outline_metadata)
 
 
+# Cache key: everything the rendered outline depends on
+def outline_key(bounds, countries, anim_width, anim_height):
+    content = {
+        'version': outline_cache_version,
+        'bounds': [round(float(value), 9) for value in bounds],
+        'countries': sorted(countries),
+        'size': [anim_width, anim_height],
+        'countries_file': list(get_country_store().key),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:32]
+
+
+# Render the outlines of often flown regions ahead of time. Each region is a list of
+# (lat, lon) points, e.g. takeoffs and turnpoints, or the coordinates of an old track.
+def prewarm_outlines(regions, anim_width, anim_height, cache_dir=outline_cache_dir):
+    outlines = []
+    for coords in regions:
+        bounds, countries = find_outline_bounds(coords)
+        outlines.append(render_outline(bounds, countries, anim_width, anim_height, cache_dir, save_path=None)[1])
+    return outlines
@@ -2,12 +2,12 @@ import math
 from PIL import Image, ImageDraw, ImageFont
 import sys
 import csv
-import json
-from datetime import datetime
 from animation_utils import make_altibar_frame
 from animation_utils import initialize_minimap
 from animation_utils import make_minimap_frame
 from animation_utils import make_goal_field
+from animation_utils import draw_text
+from map_utils import load_mosaic
 
 def get_ruler_km(map_km):
     ruler_0 = map_km / 2
@@ -85,9 +85,8 @@ def get_preview(track_points, map_images, map_metadata, outline_image_static, wi
     current_time = localtime.strftime("%H:%M")
     current_date = localtime.strftime("%Y-%m-%d")
 
-    draw6 = ImageDraw.Draw(animation_frame)
-    draw6.text((30*res_scale,30*res_scale), current_time, font=ImageFont.truetype("arial.ttf", round(40*res_scale)), fill='white')
-    draw6.text((38*res_scale,76*res_scale), current_date, font=ImageFont.truetype("arial.ttf", round(16*res_scale)), fill='white')
+    draw_text(animation_frame, (30*res_scale,30*res_scale), current_time, round(40*res_scale), 'white')
+    draw_text(animation_frame, (38*res_scale,76*res_scale), current_date, round(16*res_scale), 'white')
     
     # Draw altibar
     max_altitude = max(point["altitude"] for point in track_points)
@@ -120,35 +119,14 @@ def get_preview(track_points, map_images, map_metadata, outline_image_static, wi
 
 # Testing purposes:
 if __name__ == "__main__":
-    filename = 'track_points.csv'
-    # read track points
-    track_points = []
-    datetime_fields = ['local_time', 'timestamp']
-    with open(filename, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            for key, value in row.items():
-                try:
-                    # Try converting to float if possible
-                    row[key] = float(value)
-                except ValueError:
-                    # Check if it's a datetime field and convert
-                    if key in datetime_fields:
-                        row[key] = datetime.fromisoformat(value)
-                    else:
-                        # If conversion fails, check if it's a JSON string
-                        try:
-                            row[key] = json.loads(value)
-                        except json.JSONDecodeError:
-                            # If it's not JSON, leave it as the original string
-                            pass
-            track_points.append(row)
+    from processing_utils import load_track_points
+    track_points = load_track_points('track_points')
 
     # Read maps
-    no_map_images = len(track_points[0]["map_coordinate"])
+    no_map_images = track_points["map_xy"].shape[1]
     map_images = []
     for i in range(no_map_images):
-        map_image = Image.open(f"media/map_stitched{i}.png").convert("RGB")
+        map_image = load_mosaic(f"media/map_mosaic{i}.pickle")
         map_images.append(map_image) 
 
     outline_image_static = Image.open("media/country_outline.png").convert("RGBA")
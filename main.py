@@ -11,6 +11,18 @@ goal_type = 'open_distance' # open_distance, 3tp_distance, declared_goal
 goal_text_refefrence = 'PB: 9 km'
 target_coords = [28.101484, -16.750003] # None, [28.101484, -16.750003]
 target_radius = 400
+stream_frames = True # Pipe frames straight into ffmpeg instead of saving temp pngs
+render_workers = 8 # Processes rendering frames in parallel, 1 renders serially
+skip_identical_frames = False # Don't render frames whose key of what is drawn hasn't changed (sub-pixel changes are lost). Only rendering is skipped, ffmpeg still encodes every frame
+distance_memory_mb = 4 # Working memory for the 3tp-distance solver. Small blocks are faster (CPU cache)
+tile_url_template = None # None for Mapbox, or e.g. 'http://localhost:8000/{zoom}/{x}/{y}.png'
+tile_download_workers = 8 # Map tiles downloaded in parallel
+tile_cache_packed = False # Keep map tiles in one MBTiles file instead of one png per tile
+tile_cache_max_mb = 4000 # Least recently used tiles are removed above this size
+elevation_source = 'opentopodata' # 'opentopodata', or a folder with SRTM .hgt / GeoTIFF tiles (no network)
+elevation_url = 'https://api.opentopodata.org/v1/' # Or a self-hosted OpenTopoData, e.g. 'http://localhost:5000/v1/'
+elevation_calls_per_second = 1 # The public API allows 1. Raise it for a self-hosted server
+elevation_max_concurrent = 4 # Calls in flight at once. Only speeds things up when calls per second is raised too
 
 
 overlay_width = round(anim_height / 9 * 16 * overlay_width_percentage / 100)
@@ -18,34 +30,38 @@ minimap_width = round(1080 / 9 * 16 * overlay_width_percentage / 100 * map_scale
 dt = speedup / fps
 
 
-from process_tracklog import process_tracklog
-track_points, track_metadata = process_tracklog(track_file, dt, speedup, target_coords)
+# Guard keeps render processes from re-running the pipeline when they import this file
+if __name__ == "__main__":
+    from process_tracklog import process_tracklog
+    track_points, track_metadata = process_tracklog(track_file, dt, speedup, target_coords, distance_memory_mb, elevation_source, elevation_url, elevation_calls_per_second, elevation_max_concurrent)
 
-from get_map import get_map
-minimap_images, map_metadata = get_map(track_metadata, minimap_width, overlay_width, minimap_km, track_points, target_coords)
+    from get_map import get_map
+    from map_utils import TileStore
+    tile_store = TileStore(packed=tile_cache_packed, max_mb=tile_cache_max_mb, source=tile_url_template)
+    minimap_images, map_metadata = get_map(track_metadata, minimap_width, overlay_width, minimap_km, track_points, target_coords, tile_url_template, tile_download_workers, tile_store)
 
-from get_outline import get_outline
-outline_image, outline_metadata = get_outline(track_points, overlay_width, anim_height)
+    from get_outline import get_outline
+    outline_image, outline_metadata = get_outline(track_points, overlay_width, anim_height)
 
-from append_pixel_positions import append_pixel_positions
-track_points = append_pixel_positions(track_points, map_metadata, outline_metadata)
+    from append_pixel_positions import append_pixel_positions
+    track_points = append_pixel_positions(track_points, map_metadata, outline_metadata)
 
-from append_zoom_levels import append_zoom_levels
-track_points = append_zoom_levels(track_points, overlay_width, fps)
+    from append_zoom_levels import append_zoom_levels
+    track_points = append_zoom_levels(track_points, overlay_width, fps)
 
-from export_to_csv import export_to_csv
-export_to_csv(track_points, 'track_points.csv')
+    from processing_utils import save_track_points
+    save_track_points(track_points, 'track_points') # Read back with load_track_points
 
-from draw_path import draw_path # Unnecessary, but good for testing 
-draw_path(minimap_images, track_points) 
+    from draw_path import draw_path # Unnecessary, but good for testing 
+    draw_path(minimap_images, track_points) 
 
-from get_preview import get_preview
-get_preview(track_points, minimap_images, map_metadata, outline_image, overlay_width, anim_height, goal_type, goal_text_refefrence)
+    from get_preview import get_preview
+    get_preview(track_points, minimap_images, map_metadata, outline_image, overlay_width, anim_height, goal_type, goal_text_refefrence)
 
-from animate_path import animate_path
-animate_path(track_points, minimap_images, map_metadata, outline_image, fps, overlay_width, anim_height, transparent, goal_type, goal_text_refefrence)
+    from animate_path import animate_path
+    animate_path(track_points, minimap_images, map_metadata, outline_image, fps, overlay_width, anim_height, transparent, goal_type, goal_text_refefrence, stream_frames, render_workers, skip_identical_frames)
 
-print("Done!")
+    print("Done!")
 
 
 
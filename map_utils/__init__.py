@@ -0,0 +1,15 @@
+from .tile_fetcher import TileFetcher
+from .tile_store import TileStore
+from .tile_store import tile_cache_path
+from .tile_coverage import plan_tile_coverage
+from .tile_coverage import find_missing_tiles
+from .lazy_mosaic import LazyMosaic
+from .lazy_mosaic import load_mosaic
+from .projection import mercator_y
+from .projection import tile_coords
+from .projection import tile_lon
+from .projection import tile_lat
+from .projection import layer_affines
+from .projection import project_layers
+from .country_store import CountryStore
+from .country_store import get_country_store
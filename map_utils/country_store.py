@@ -0,0 +1,94 @@
+import os
+import pickle
+from functools import lru_cache
+import numpy as np
+import shapely
+import pyproj
+
+cache_version = 1
+
+
+class CountryStore:
+    # Country polygons for the outline map, read once. Countries are split into single
+    # polygons (islands, exclaves) with their country name, equal-area size (km2, EPSG:6933)
+    # and a representative point (lat, lon), and an STRtree finds polygons by location.
+    # The preprocessed polygons are kept in a pickle next to the GeoJSON and rebuilt
+    # when the GeoJSON changes.
+    def __init__(self, path='countries.geojson', cache_path=None):
+        self.path = path
+        self.cache_path = cache_path if cache_path is not None else f"{path}.pickle"
+        stat = os.stat(path)
+        key = (cache_version, stat.st_mtime_ns, stat.st_size)
+        data = None
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'rb') as file:
+                    data = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                data = None
+            if data is not None and data['key'] != key:
+                data = None
+        if data is None:
+            data = self.preprocess(path)
+            data['key'] = key
+            temp_path = f"{self.cache_path}.part"
+            with open(temp_path, 'wb') as file:
+                pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        self.key = key
+        self.countries = data['countries'] # Country name per country
+        self.country_geometries = data['country_geometries']
+        self.polygons = data['polygons']
+        self.polygon_country = data['polygon_country'] # Index into countries per polygon
+        self.areas = data['areas']
+        self.points = data['points']
+        self.tree = shapely.STRtree(self.polygons)
+
+    @staticmethod
+    def preprocess(path):
+        import geopandas as gpd
+        print(f"Preparing country polygons from {path}...")
+        world_gdf = gpd.read_file(path)
+        country_geometries = world_gdf.geometry.to_numpy()
+        keep = np.isin(shapely.get_type_id(country_geometries), (3, 6)) # Polygon, MultiPolygon
+        # Decompose MultiPolygons into individual polygons and include country name
+        polygons, polygon_country = shapely.get_parts(country_geometries[keep], return_index=True)
+        polygon_country = np.flatnonzero(keep)[polygon_country]
+
+        # Areas and points in an equal-area projection, points converted back to WGS84
+        to_equal_area = pyproj.Transformer.from_crs(world_gdf.crs, "EPSG:6933", always_xy=True)
+        from_equal_area = pyproj.Transformer.from_crs("EPSG:6933", "EPSG:4326", always_xy=True)
+        projected = shapely.transform(polygons, lambda xy: np.column_stack(to_equal_area.transform(xy[:, 0], xy[:, 1])))
+        areas = shapely.area(projected) / 10**6 # Convert area from square meters to square kilometers
+        point_xy = shapely.get_coordinates(shapely.point_on_surface(projected))
+        lon, lat = from_equal_area.transform(point_xy[:, 0], point_xy[:, 1])
+
+        return {
+            'countries': world_gdf['ADMIN'].to_numpy(dtype=object),
+            'country_geometries': country_geometries,
+            'polygons': polygons,
+            'polygon_country': polygon_country,
+            'areas': areas,
+            'points': np.column_stack((lat, lon)),
+        }
+
+    def polygons_containing(self, lats, lons):
+        # Indices of the polygons that contain at least one of the points, in file order
+        points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        _, polygon_index = self.tree.query(points, predicate='within')
+        return np.unique(polygon_index)
+
+    def polygons_in_box(self, lon_min, lat_min, lon_max, lat_max):
+        # Indices of the polygons intersecting the box, in file order
+        return np.sort(self.tree.query(shapely.box(lon_min, lat_min, lon_max, lat_max), predicate='intersects'))
+
+    def countries_in_box(self, lon_min, lat_min, lon_max, lat_max):
+        # Whole country geometries with any part in the box
+        country_index = np.unique(self.polygon_country[self.polygons_in_box(lon_min, lat_min, lon_max, lat_max)])
+        return self.country_geometries[country_index]
+
+
+@lru_cache(maxsize=None)
+def get_country_store(path='countries.geojson'):
+    # One store per file and process
+    return CountryStore(path)
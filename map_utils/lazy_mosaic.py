@@ -0,0 +1,153 @@
+import math
+import pickle
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+class LazyMosaic:
+    # Stands in for a stitched and resized map image of one zoom level, without ever
+    # building it. crop(box) assembles only the blocks under the box: tiles from the
+    # TileStore are pasted, resized and given the target overlay block by block, and
+    # recently used blocks are kept. Lines drawn with draw_line are recorded and drawn
+    # onto blocks as they are used, so memory follows the viewport, not the flight.
+    #   origin: tile (x, y) at the top left corner; size: (width, height) after resizing
+    #   target: (x, y, radius) in output pixels, or None
+    def __init__(self, store, tiles, zoom, origin, cell_size, source_size, size, target=None, block_size=256, memory_blocks=64):
+        self.store = store
+        self.tiles = set(map(tuple, np.asarray(tiles).reshape(-1, 2).tolist()))
+        self.zoom = zoom
+        self.origin = origin
+        self.cell_size = cell_size
+        self.source_size = source_size
+        self.size = size
+        self.target = target
+        self.block_size = block_size
+        self.memory_blocks = memory_blocks
+        self.lines = [] # (x0, y0, x1, y1) in output pixels
+        self.line_styles = [] # (fill, width)
+        self.blocks = OrderedDict() # (column, row) -> [image, lines drawn on it]
+
+    def __getstate__(self):
+        # Rendered blocks are left out; they are rebuilt from the tiles on demand
+        state = self.__dict__.copy()
+        state['blocks'] = OrderedDict()
+        return state
+
+    def copy(self):
+        # Independent copy for drawing on, sharing the tile store; starts with the
+        # rendered blocks of this one
+        mosaic = LazyMosaic.__new__(LazyMosaic)
+        mosaic.__dict__.update(self.__dict__)
+        mosaic.lines = list(self.lines)
+        mosaic.line_styles = list(self.line_styles)
+        mosaic.blocks = OrderedDict()
+        for key, (image, drawn) in self.blocks.items():
+            mosaic.blocks[key] = [image.copy(), drawn]
+        return mosaic
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    def draw_line(self, xy, fill, width=1):
+        # Like ImageDraw.line for one segment
+        self.lines.append(tuple(float(value) for value in xy))
+        self.line_styles.append((fill, width))
+
+    def crop(self, box):
+        # Like Image.crop: the box is rounded to whole pixels, outside the map is black
+        x0, y0, x1, y1 = (int(round(value)) for value in box)
+        image = Image.new('RGB', (x1 - x0, y1 - y0))
+        width, height = self.size
+        size = self.block_size
+        for row in range(max(y0, 0) // size, (min(y1, height) - 1) // size + 1):
+            for column in range(max(x0, 0) // size, (min(x1, width) - 1) // size + 1):
+                image.paste(self.get_block(column, row), (column * size - x0, row * size - y0))
+        return image
+
+    def to_image(self):
+        return self.crop((0, 0) + tuple(self.size))
+
+    def get_block(self, column, row):
+        key = (column, row)
+        if key in self.blocks:
+            self.blocks.move_to_end(key)
+            block = self.blocks[key]
+        else:
+            block = [self.render_block(column, row), 0]
+            self.blocks[key] = block
+            if len(self.blocks) > self.memory_blocks:
+                self.blocks.popitem(last=False)
+        if block[1] < len(self.lines):
+            self.draw_lines(block[0], column * self.block_size, row * self.block_size, block[1])
+            block[1] = len(self.lines)
+        return block[0]
+
+    def render_block(self, column, row):
+        # Same pixels as stitching the whole map and resizing it, for one block
+        width, height = self.size
+        source_width, source_height = self.source_size
+        x0 = column * self.block_size
+        y0 = row * self.block_size
+        x1 = min(x0 + self.block_size, width)
+        y1 = min(y0 + self.block_size, height)
+        scale_x = source_width / width
+        scale_y = source_height / height
+        # Source pixels under the block, with room for the resampling filter
+        margin = math.ceil(3 * max(scale_x, scale_y, 1)) + 1
+        source_x0 = max(math.floor(x0 * scale_x) - margin, 0)
+        source_y0 = max(math.floor(y0 * scale_y) - margin, 0)
+        source_x1 = min(math.ceil(x1 * scale_x) + margin, source_width)
+        source_y1 = min(math.ceil(y1 * scale_y) + margin, source_height)
+        source = Image.new('RGB', (source_x1 - source_x0, source_y1 - source_y0))
+        cell = self.cell_size
+        origin_x, origin_y = self.origin
+        for y in range(origin_y + source_y0 // cell, origin_y + (source_y1 - 1) // cell + 1):
+            for x in range(origin_x + source_x0 // cell, origin_x + (source_x1 - 1) // cell + 1):
+                if (x, y) in self.tiles:
+                    tile_img = self.store.get_tile_image(x, y, self.zoom)
+                    if tile_img is not None:
+                        source.paste(tile_img, ((x - origin_x) * cell - source_x0, (y - origin_y) * cell - source_y0))
+        box = (x0 * scale_x - source_x0, y0 * scale_y - source_y0, x1 * scale_x - source_x0, y1 * scale_y - source_y0)
+        block = source.resize((x1 - x0, y1 - y0), Image.Resampling.LANCZOS, box=box)
+
+        if self.target is not None:
+            x_target, y_target, radius = self.target
+            if x_target + radius >= x0 and x_target - radius < x1 and y_target + radius >= y0 and y_target - radius < y1:
+                # Transparent circle with a white outline. Computed per pixel rather than
+                # with ImageDraw.ellipse, which rounds differently once the circle starts
+                # outside the block, so the circle would not line up between blocks.
+                y, x = np.mgrid[y0:y1, x0:x1]
+                distance = np.hypot(x - x_target, y - y_target)
+                trans_image = np.zeros((y1 - y0, x1 - x0, 4), dtype=np.uint8)
+                trans_image[distance <= radius] = (0, 128, 0, 100)
+                trans_image[(distance <= radius) & (distance > radius - 1)] = (255, 255, 255, 255)
+                block = Image.alpha_composite(block.convert("RGBA"), Image.fromarray(trans_image, 'RGBA')).convert("RGB")
+        return block
+
+    def draw_lines(self, image, x0, y0, start):
+        # Draws recorded lines from index start that reach into the block at (x0, y0)
+        lines = np.asarray(self.lines[start:]).reshape(-1, 4)
+        reach = np.array([style[1] for style in self.line_styles[start:]]) / 2 + 1
+        x_low = np.minimum(lines[:, 0], lines[:, 2]) - reach
+        x_high = np.maximum(lines[:, 0], lines[:, 2]) + reach
+        y_low = np.minimum(lines[:, 1], lines[:, 3]) - reach
+        y_high = np.maximum(lines[:, 1], lines[:, 3]) + reach
+        inside = (x_high >= x0) & (x_low < x0 + image.size[0]) & (y_high >= y0) & (y_low < y0 + image.size[1])
+        for k in np.flatnonzero(inside).tolist():
+            fill, width = self.line_styles[start + k]
+            # Each line is drawn on its own mask with its corner at whole pixels, which
+            # keeps the coordinates positive: ImageDraw rounds negative ones differently,
+            # and the line would not match across block edges
+            mask_x0 = math.floor(x_low[k]) - 1
+            mask_y0 = math.floor(y_low[k]) - 1
+            mask = Image.new('L', (math.ceil(x_high[k]) + 2 - mask_x0, math.ceil(y_high[k]) + 2 - mask_y0))
+            line_x0, line_y0, line_x1, line_y1 = self.lines[start + k]
+            ImageDraw.Draw(mask).line((line_x0 - mask_x0, line_y0 - mask_y0, line_x1 - mask_x0, line_y1 - mask_y0), fill=255, width=width)
+            image.paste(fill, (mask_x0 - x0, mask_y0 - y0), mask)
+
+
+def load_mosaic(path):
+    with open(path, 'rb') as file:
+        return pickle.load(file)
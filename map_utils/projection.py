@@ -0,0 +1,49 @@
+import numpy as np
+
+# Web-Mercator math shared by the tile planner, get_map and append_pixel_positions.
+# A "layer" is an image covering a lon/lat box (a minimap zoom level or the outline);
+# its pixels are an affine function of (lon, mercator_y(lat)).
+
+
+def mercator_y(lat):
+    return np.log(np.tan(np.pi/4 + np.asarray(lat, dtype=float)/360*np.pi))
+
+
+def tile_coords(lat, lon, zoom):
+    # Tile (x, y) containing each point; arrays broadcast, so several zooms go at once
+    n = 2.0 ** np.asarray(zoom)
+    x_tile = (np.asarray(lon, dtype=float) + 180.0) / 360.0 * n
+    y_tile = (1.0 - mercator_y(lat) / np.pi) / 2.0 * n
+    return x_tile.astype(np.int64), y_tile.astype(np.int64)
+
+
+def tile_lon(x, zoom):
+    # Longitude of the west edge of tile column x
+    return np.asarray(x) * 360 / 2.0**zoom - 180
+
+
+def tile_lat(y, zoom):
+    # Latitude of the north edge of tile row y
+    return 360 / np.pi * (np.arctan(np.exp(np.pi * (1 - 2 * np.asarray(y) / 2.0**zoom))) - np.pi / 4)
+
+
+def layer_affines(bounds):
+    # bounds: one (lon_min, lat_min, lon_max, lat_max, width, height) per layer.
+    # Returns (n_layers, 4) parameters: x = a_x * lon + b_x, y = a_y * mercator_y(lat) + b_y
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 6)
+    lon_min, lat_min, lon_max, lat_max, width, height = bounds.T
+    y_bottom = mercator_y(lat_min)
+    y_top = mercator_y(lat_max)
+    a_x = width / (lon_max - lon_min)
+    a_y = -height / (y_top - y_bottom)
+    return np.column_stack((a_x, -lon_min * a_x, a_y, -y_top * a_y))
+
+
+def project_layers(lat, lon, affines):
+    # Pixel positions of all points on all layers, shape (n_points, n_layers, 2)
+    lon = np.asarray(lon, dtype=float).reshape(-1, 1)
+    y = mercator_y(lat).reshape(-1, 1)
+    xy = np.empty((len(lon), len(affines), 2))
+    xy[:, :, 0] = lon * affines[:, 0] + affines[:, 1]
+    xy[:, :, 1] = y * affines[:, 2] + affines[:, 3]
+    return xy
@@ -0,0 +1,52 @@
+import math
+import numpy as np
+from .projection import tile_coords
+
+default_tile_bytes = 200 * 1024 # Rough size of a 512 px satellite tile, used while the cache is empty
+
+
+def sample_track(lats, lons, spacing):
+    # Indices of the points where tiles are looked up: the first point, then every point
+    # more than spacing (meters) from the previous sample. Flat-earth distance, as before.
+    radius = 6371000.0
+    lats = np.asarray(lats, dtype=float).tolist()
+    lons = np.asarray(lons, dtype=float).tolist()
+    samples = [0]
+    prev_lat = lats[0]
+    prev_lon = lons[0]
+    cos_prev = math.cos(prev_lat / 180 * math.pi)
+    limit = spacing**2
+    for i in range(1, len(lats)):
+        d_y = (prev_lat - lats[i]) / 180 * math.pi * radius
+        d_x = (lons[i] - prev_lon) / 180 * math.pi * cos_prev * radius
+        if d_x**2 + d_y**2 > limit:
+            samples.append(i)
+            prev_lat = lats[i]
+            prev_lon = lons[i]
+            cos_prev = math.cos(prev_lat / 180 * math.pi)
+    return np.array(samples)
+
+
+def plan_tile_coverage(lats, lons, zoom_min, zoom_max, spacing):
+    # Tiles needed to follow the track: the 3x3 block around every sampled point, for every
+    # zoom level. Returns {zoom: (n, 2) array of unique x, y}, zooms from max to min.
+    samples = sample_track(lats, lons, spacing)
+    zooms = np.arange(zoom_max, zoom_min - 1, -1)
+    # All zooms and samples at once, shape (n_zooms, n_samples)
+    x_tile, y_tile = tile_coords(np.asarray(lats, dtype=float)[samples], np.asarray(lons, dtype=float)[samples], zooms[:, None])
+    offset_x, offset_y = np.meshgrid([-1, 0, 1], [-1, 0, 1])
+    tiles = {}
+    for i, zoom in enumerate(zooms.tolist()):
+        x = (x_tile[i][:, None] + offset_x.ravel()).ravel()
+        y = (y_tile[i][:, None] + offset_y.ravel()).ravel()
+        tiles[zoom] = np.unique(np.column_stack((x, y)), axis=0)
+    return tiles
+
+
+def find_missing_tiles(tiles, store):
+    # Tiles from plan_tile_coverage that aren't in the store, as [x, y, zoom] lists, and
+    # the bytes expected to download them
+    wanted = [[x, y, zoom] for zoom, xy in tiles.items() for x, y in xy.tolist()]
+    missing = store.missing_tiles(wanted)
+    tile_bytes = store.average_tile_size() or default_tile_bytes
+    return missing, round(len(missing) * tile_bytes)
@@ -0,0 +1,93 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from .tile_store import TileStore, tile_type
+
+mapbox_url_template = "https://api.mapbox.com/styles/v1/{tile_type}/tiles/{zoom}/{x}/{y}?access_token={token}"
+
+
+@lru_cache(maxsize=None)
+def get_api_token():
+    # Reads .env once per process
+    load_dotenv()
+    return os.getenv('MAPBOX_API_TOKEN')
+
+
+class TileFetcher:
+    # Downloads map tiles into a TileStore over a pooled HTTP session, several at a time.
+    # url_template gets {x}, {y}, {zoom}, {tile_type} and {token}; point it at a local
+    # server to test without Mapbox. The store must be for the same source (TileStore(source=...)).
+    def __init__(self, url_template=None, max_workers=8, max_retries=3, backoff=1, timeout=30, store=None):
+        self.url_template = url_template if url_template is not None else mapbox_url_template
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.store = store if store is not None else TileStore(source=url_template)
+        if self.store.source != url_template:
+            raise ValueError(f"Tile store is for {self.store.source or 'Mapbox'} tiles, not {url_template or 'Mapbox'}")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_url(self, x, y, zoom):
+        token = get_api_token() if '{token}' in self.url_template else None
+        return self.url_template.format(x=x, y=y, zoom=zoom, tile_type=tile_type, token=token)
+
+    def has_tile(self, x, y, zoom):
+        return self.store.has_tile(x, y, zoom)
+
+    def download_tile(self, x, y, zoom):
+        # Returns the number of bytes stored, None if the tile could not be downloaded
+        url = self.get_url(x, y, zoom)
+        for attempt in range(self.max_retries):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as error:
+                problem = str(error)
+            else:
+                if response.status_code == 200:
+                    self.store.put_tile(x, y, zoom, response.content)
+                    return len(response.content)
+                problem = f"HTTP {response.status_code}"
+                if response.status_code == 404:
+                    break
+            if attempt < self.max_retries - 1:
+                time.sleep(self.backoff * 2**attempt)
+        print(f'Unable to download map image for tile ({x}, {y}, {zoom}): {problem}')
+        return None
+
+    def fetch_tiles(self, tiles):
+        # Downloads all [x, y, zoom] tiles, returns the ones that failed
+        if len(tiles) == 0:
+            return []
+        print(f"Downloading {len(tiles)} map tiles ({self.max_workers} at a time)...")
+        start_time = time.time()
+        total_bytes = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download_tile, x, y, zoom): [x, y, zoom] for x, y, zoom in tiles}
+            for done, future in enumerate(as_completed(futures), 1):
+                size = future.result()
+                if size is None:
+                    failed.append(futures[future])
+                else:
+                    total_bytes += size
+                if done % 50 == 0:
+                    print(f"{done}/{len(tiles)} tiles")
+        seconds = max(time.time() - start_time, 1e-6)
+        print(f"Downloaded {len(tiles) - len(failed)} tiles in {round(seconds, 1)} s ({round((len(tiles) - len(failed)) / seconds, 1)} tiles/s, {round(total_bytes / seconds / 2**20, 2)} MB/s)")
+        return failed
+
+    def get_tile_image(self, x, y, zoom):
+        # One tile from the store, downloading it first if needed
+        if not self.store.has_tile(x, y, zoom):
+            print("Downloading map tile")
+            if self.download_tile(x, y, zoom) is None:
+                return None
+        return self.store.get_tile_image(x, y, zoom)
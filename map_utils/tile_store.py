@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from hashlib import md5
+from io import BytesIO
+from PIL import Image
+
+tile_type = 'saywhoooaaat/clok9ytkg006501pl9gima19q' # Custom satellite-map
+
+
+def tile_cache_path(x, y, zoom, cache_dir='tile_cache'):
+    cache_key = md5(f"{tile_type}/{zoom}/{x}/{y}".encode('utf-8')).hexdigest()
+    return f"{cache_dir}/{cache_key}.png"
+
+
+class TileStore:
+    # Map tile cache. Decoded tiles are kept in memory (least recently used are dropped),
+    # and an SQLite index on disk knows every stored tile with its size, age and last use,
+    # so the cache can be capped. Tiles are stored either as files in cache_dir (the old
+    # md5-named pngs) or, with packed=True, all in one MBTiles file.
+    # source is the URL template the tiles come from, None for Mapbox. Other sources get
+    # their own folder in cache_dir, so e.g. a local test server never fills the Mapbox cache.
+    def __init__(self, cache_dir='tile_cache', packed=False, memory_tiles=64, max_mb=4000, max_age_days=365, source=None):
+        self.source = source
+        if source is not None:
+            cache_dir = os.path.join(cache_dir, f"source_{md5(source.encode('utf-8')).hexdigest()[:16]}")
+        self.cache_dir = cache_dir
+        self.packed = packed
+        self.memory_tiles = memory_tiles
+        self.max_bytes = max_mb * 2**20
+        self.max_age = max_age_days * 24 * 3600
+        os.makedirs(cache_dir, exist_ok=True)
+        self.open()
+
+    def open(self):
+        self.images = OrderedDict() # (x, y, zoom) -> decoded image
+        self.used = {} # (x, y, zoom) -> time, written to the index in batches
+        self.lock = threading.Lock() # Tiles arrive from several download threads
+        self.pid = os.getpid()
+        packed = self.packed
+        cache_dir = self.cache_dir
+        index_path = f"{cache_dir}/tiles.mbtiles" if packed else f"{cache_dir}/index.sqlite"
+        self.connection = sqlite3.connect(index_path, timeout=60, check_same_thread=False)
+        # Incremental auto-vacuum lets evict hand freed pages back, so the file shrinks
+        if self.connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            self.connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            if self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'tile_index'").fetchone():
+                # Cache from before auto-vacuum, takes a full rebuild once
+                print("Compacting map tile cache...")
+                self.connection.execute('VACUUM')
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS tile_index (
+                zoom INTEGER, x INTEGER, y INTEGER, size INTEGER, created REAL, last_used REAL,
+                PRIMARY KEY (zoom, x, y)
+            ) WITHOUT ROWID''')
+            if packed:
+                # MBTiles layout, readable by other tools (rows are flipped, TMS style)
+                self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)')
+                self.connection.execute('CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))')
+                self.connection.execute("INSERT OR IGNORE INTO metadata VALUES ('name', ?)", (tile_type,))
+                self.connection.execute("INSERT OR IGNORE INTO metadata VALUES ('format', 'png')")
+
+    def __getstate__(self):
+        # Sent to render processes as settings only; each process opens its own connection
+        return {key: getattr(self, key) for key in ('source', 'cache_dir', 'packed', 'memory_tiles', 'max_bytes', 'max_age')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def has_tile(self, x, y, zoom):
+        key = (x, y, zoom)
+        if key in self.images:
+            return True
+        with self.lock:
+            if self.connection.execute('SELECT 1 FROM tile_index WHERE zoom = ? AND x = ? AND y = ?', (zoom, x, y)).fetchone():
+                return True
+        if not self.packed:
+            # Tile from before the index existed
+            cache_path = tile_cache_path(x, y, zoom, self.cache_dir)
+            if os.path.exists(cache_path):
+                stat = os.stat(cache_path)
+                self.add_to_index(x, y, zoom, stat.st_size, stat.st_mtime)
+                return True
+        return False
+
+    def missing_tiles(self, tiles):
+        # The [x, y, zoom] tiles that aren't stored, with one index query for all of them
+        with self.lock:
+            indexed = set(self.connection.execute('SELECT x, y, zoom FROM tile_index'))
+        return [tile for tile in tiles if tuple(tile) not in indexed and not self.has_tile(*tile)]
+
+    def average_tile_size(self):
+        # Mean stored tile size in bytes, None while the cache is empty
+        with self.lock:
+            return self.connection.execute('SELECT AVG(size) FROM tile_index').fetchone()[0]
+
+    def put_tile(self, x, y, zoom, data):
+        # Stores the encoded tile as received
+        if self.packed:
+            with self.lock, self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', (zoom, x, 2**zoom - 1 - y, data))
+        else:
+            # Writing to a temp name first means a half-written file never looks like a cached tile
+            cache_path = tile_cache_path(x, y, zoom, self.cache_dir)
+            temp_path = f"{cache_path}.{threading.get_ident()}.part"
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, cache_path)
+        self.add_to_index(x, y, zoom, len(data), time.time())
+
+    def add_to_index(self, x, y, zoom, size, created):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO tile_index VALUES (?, ?, ?, ?, ?, ?)', (zoom, x, y, size, created, time.time()))
+
+    def get_tile_image(self, x, y, zoom):
+        # Decoded tile, None if it isn't stored. The image is shared: don't draw on it
+        if self.pid != os.getpid():
+            # Forked process: SQLite connections can't be shared with the parent
+            self.open()
+        key = (x, y, zoom)
+        self.used[key] = time.time()
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+        data = self.read_tile(x, y, zoom)
+        if data is None:
+            return None
+        img = Image.open(BytesIO(data))
+        img.load()
+        self.images[key] = img
+        if len(self.images) > self.memory_tiles:
+            self.images.popitem(last=False)
+        return img
+
+    def read_tile(self, x, y, zoom):
+        if self.packed:
+            with self.lock:
+                row = self.connection.execute('SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', (zoom, x, 2**zoom - 1 - y)).fetchone()
+            return row[0] if row else None
+        cache_path = tile_cache_path(x, y, zoom, self.cache_dir)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, 'rb') as file:
+            return file.read()
+
+    def flush(self):
+        # Writes last-use times collected since the last flush
+        used = self.used
+        self.used = {}
+        with self.lock, self.connection:
+            self.connection.executemany('UPDATE tile_index SET last_used = ? WHERE zoom = ? AND x = ? AND y = ?',
+                ((last_used, zoom, x, y) for (x, y, zoom), last_used in used.items()))
+
+    def evict(self, keep=()):
+        # Drops tiles older than max_age_days, then least recently used ones until the
+        # cache is below max_mb. Tiles in keep ((x, y, zoom), e.g. the ones a flight is
+        # about to render) count as used now and are never dropped.
+        keep = set(tuple(tile) for tile in keep)
+        now = time.time()
+        for key in keep:
+            self.used[key] = now
+        self.flush()
+        with self.lock:
+            old = self.connection.execute('SELECT zoom, x, y, size FROM tile_index WHERE created < ?', (now - self.max_age,)).fetchall()
+            old = [row for row in old if (row[1], row[2], row[0]) not in keep]
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM tile_index').fetchone()[0]
+            evicted = list(old)
+            total -= sum(row[3] for row in old)
+            if total > self.max_bytes:
+                old_keys = set(row[:3] for row in old)
+                for zoom, x, y, size in self.connection.execute('SELECT zoom, x, y, size FROM tile_index ORDER BY last_used'):
+                    if total <= self.max_bytes:
+                        break
+                    if (zoom, x, y) not in old_keys and (x, y, zoom) not in keep:
+                        evicted.append((zoom, x, y, size))
+                        total -= size
+            with self.connection:
+                self.connection.executemany('DELETE FROM tile_index WHERE zoom = ? AND x = ? AND y = ?', (row[:3] for row in evicted))
+                if self.packed:
+                    self.connection.executemany('DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                        ((zoom, x, 2**zoom - 1 - y) for zoom, x, y, _ in evicted))
+            if evicted:
+                # Free the deleted pages and truncate the WAL, else the file keeps its size
+                self.connection.executescript('PRAGMA incremental_vacuum') # execute() would free only one page
+                self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        for zoom, x, y, _ in evicted:
+            self.images.pop((x, y, zoom), None)
+            if not self.packed:
+                try:
+                    os.remove(tile_cache_path(x, y, zoom, self.cache_dir))
+                except FileNotFoundError:
+                    pass
+        if evicted:
+            print(f"Evicted {len(evicted)} map tiles from the cache ({round(total / 2**20)} MB left)")
+        return len(evicted)
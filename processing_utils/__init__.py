@@ -1,9 +1,20 @@
 from .parse_gpx import parse_gpx
+from .parse_gpx import read_gpx
 from .parse_igc import parse_igc
+from .parse_igc import read_igc
 from .parse_tcx import parse_tcx
+from .parse_tcx import read_tcx
 from .smooth_data import smooth_data
 from .smooth_angles import smooth_angles
 from .get_ground_elevation import get_ground_elevation
 from .collect_3tp_distances import collect_3tp_distances
 from .collect_open_distances import collect_open_distances
 
+from .track_table import TrackTable
+from .elevation_providers import get_elevation_provider
+from .elevation_providers import OpenTopoDataProvider
+from .elevation_providers import DEMProvider
+from .elevation_providers import FakeProvider
+from .elevation_providers import ElevationFetchError
+from .track_io import save_track_points
+from .track_io import load_track_points
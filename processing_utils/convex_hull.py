@@ -0,0 +1,28 @@
+import numpy as np
+
+
+def convex_hull(x, y):
+    # Andrew's monotone chain. Returns indices of the hull vertices, counter-clockwise,
+    # without collinear points (1 or 2 indices for degenerate input)
+    order = np.lexsort((y, x))
+    points = [(x[i], y[i], i) for i in order]
+    if len(points) <= 2:
+        return np.array([p[2] for p in points], dtype=int)
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    hull = lower[:-1] + upper[:-1]
+    if len(hull) == 2 and hull[0][:2] == hull[1][:2]:
+        hull = hull[:1]
+    return np.array([p[2] for p in hull], dtype=int)
@@ -0,0 +1,40 @@
+import numpy as np
+
+radius = 6371000.0
+
+
+def distance_row_blocks(lons, lats, memory_budget_mb=4):
+    # Yields (start, stop, rows) where rows[r, j] is the distance between point start+r
+    # and point j, for every j < stop. Same formula as flat_distance, but nothing n x n
+    # is ever allocated: blocks of rows are sized so their working arrays fit the budget.
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    x = lons / 180 * np.pi * radius
+    y = lats / 180 * np.pi * radius
+    # cos of the mean latitude of a pair: cos(a + b) = cos(a)cos(b) - sin(a)sin(b) with half latitudes
+    half_lats = lats / 360 * np.pi
+    cos_half = np.cos(half_lats)
+    sin_half = np.sin(half_lats)
+
+    # Only a block of one row is allowed to exceed the budget (a tiny budget on a long track)
+    budget_bytes = int(memory_budget_mb * 2**20)
+    arrays_per_block = 4 # Rows plus temporaries, float64 each
+    n = len(lons)
+    start = 0
+    while start < n:
+        # Largest block with block_size * (start + block_size) values per array in the budget
+        values = budget_bytes / (arrays_per_block * 8)
+        block_size = int((np.sqrt(start**2 + 4 * values) - start) / 2)
+        block_size = min(max(block_size, 1), 1024)
+        stop = min(start + block_size, n)
+        cos_mean = cos_half[start:stop, None] * cos_half[:stop]
+        cos_mean -= sin_half[start:stop, None] * sin_half[:stop]
+        dx = x[start:stop, None] - x[:stop]
+        dx *= cos_mean
+        dx *= dx
+        rows = y[start:stop, None] - y[:stop]
+        rows *= rows
+        rows += dx
+        np.sqrt(rows, out=rows)
+        yield start, stop, rows
+        start = stop
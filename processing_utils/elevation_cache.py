@@ -0,0 +1,55 @@
+import sqlite3
+import json
+import os
+
+# Elevation cache shared by all runs on this machine. SQLite in WAL mode lets several
+# pipelines read while one writes, and every batch of new points is one transaction,
+# so a crash can't leave a half-written cache behind.
+cache_path = 'elevation_cache.sqlite'
+legacy_json_path = 'elevation_cache.json'
+
+
+def open_elevation_cache(path=cache_path, legacy_path=legacy_json_path):
+    connection = sqlite3.connect(path, timeout=60) # Waits for other writers instead of failing
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        # Grid coordinates in 1e-5 degrees
+        connection.execute('''CREATE TABLE IF NOT EXISTS elevation (
+            lat_key INTEGER NOT NULL,
+            lon_key INTEGER NOT NULL,
+            elevation REAL,
+            PRIMARY KEY (lat_key, lon_key)
+        ) WITHOUT ROWID''')
+        connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    migrate_json_cache(connection, legacy_path)
+    return connection
+
+
+def migrate_json_cache(connection, legacy_path):
+    # One-time import of the old elevation_cache.json ([lat, lon, ele] list). The json is left in place.
+    if not os.path.exists(legacy_path):
+        return
+    if connection.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+        return
+    print(f"Moving {legacy_path} into {cache_path}...")
+    with open(legacy_path, 'r') as file:
+        elevation_data = json.load(file)
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO elevation VALUES (?, ?, ?)',
+            ((round(lat * 10**5), round(lon * 10**5), ele) for lat, lon, ele in elevation_data))
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('json_migrated', ?)", (str(len(elevation_data)),))
+
+
+def load_elevations(connection, lat_key_min, lat_key_max, lon_key_min, lon_key_max):
+    # Cached elevations inside a box, as {(lat_key, lon_key): elevation}
+    rows = connection.execute('SELECT lat_key, lon_key, elevation FROM elevation WHERE lat_key BETWEEN ? AND ? AND lon_key BETWEEN ? AND ?',
+        (lat_key_min, lat_key_max, lon_key_min, lon_key_max))
+    return {(lat_key, lon_key): elevation for lat_key, lon_key, elevation in rows}
+
+
+def store_elevations(connection, keys, elevations):
+    # Adds a batch of new points in one transaction. Points another run stored first are kept.
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO elevation VALUES (?, ?, ?)',
+            ((lat_key, lon_key, elevation) for (lat_key, lon_key), elevation in zip(keys, elevations)))
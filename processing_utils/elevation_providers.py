@@ -0,0 +1,210 @@
+import asyncio
+import os
+import re
+import numpy as np
+import requests
+
+# Elevation providers turn [[lat, lon], ...] into a list of elevations (meters), in order.
+# They raise instead of returning fewer values, so results can never be misaligned.
+# "cached" says whether results should go into the shared elevation cache.
+
+
+class ElevationFetchError(RuntimeError):
+    # Some points failed. partial has one value per point, None where it is missing,
+    # so the points that did arrive can still be cached.
+    def __init__(self, message, partial):
+        super().__init__(message)
+        self.partial = partial
+
+
+class OpenTopoDataProvider:
+    # opentopodata.org (or a self-hosted instance). Batches run concurrently on an
+    # asyncio loop, with calls spread out to respect the rate limit and retried on errors.
+    # Calls start 1/calls_per_second apart, so at the public API's 1 call/s a second call
+    # in flight only helps while a response takes longer than a second. max_concurrent
+    # matters once a self-hosted server allows a higher rate.
+    cached = True
+
+    def __init__(self, dataset='aster30m', url='https://api.opentopodata.org/v1/', batch_size=100, calls_per_second=1, max_concurrent=4, retries=4):
+        self.url = url + dataset
+        self.batch_size = batch_size
+        self.calls_per_second = calls_per_second
+        self.max_concurrent = max_concurrent
+        self.retries = retries
+
+    def get_elevations(self, coordinates):
+        coordinates = [[float(lat), float(lon)] for lat, lon in coordinates]
+        batches = [coordinates[i:i+self.batch_size] for i in range(0, len(coordinates), self.batch_size)]
+        if not batches:
+            return []
+        print(f"Calling API for elevation data ({len(coordinates)} points, {len(batches)} calls)")
+        results = asyncio.run(self.fetch_batches(batches))
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Batches that finished are kept, failed ones are None
+            partial = []
+            for batch, result in zip(batches, results):
+                partial.extend([None] * len(batch) if isinstance(result, BaseException) else result)
+            raise ElevationFetchError(f"{len(errors)} of {len(batches)} elevation requests failed ({errors[0]})", partial) from errors[0]
+        return [elevation for batch_result in results for elevation in batch_result]
+
+    async def fetch_batches(self, batches):
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.rate_lock = asyncio.Lock()
+        self.next_call = 0
+        with requests.Session() as session:
+            return await asyncio.gather(*(self.fetch_batch(session, batch) for batch in batches), return_exceptions=True)
+
+    async def wait_for_turn(self):
+        # Calls start at least 1/calls_per_second apart
+        async with self.rate_lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self.next_call)
+            self.next_call = start + 1 / self.calls_per_second
+        await asyncio.sleep(start - now)
+
+    async def fetch_batch(self, session, batch):
+        # Joining locations as a pipe-separated string of lat,lon pairs
+        locations_param = '|'.join([f"{lat},{lon}" for lat, lon in batch])
+        for attempt in range(self.retries + 1):
+            async with self.slots:
+                await self.wait_for_turn()
+                try:
+                    response = await asyncio.to_thread(session.get, self.url, params={"locations": locations_param}, timeout=30)
+                except requests.RequestException as error:
+                    problem = str(error)
+                else:
+                    if response.status_code == 200:
+                        try:
+                            results = response.json()['results'] # ValueError if it isn't JSON
+                        except (ValueError, KeyError, TypeError) as error:
+                            problem = f"invalid response ({error!r})"
+                        else:
+                            if len(results) == len(batch):
+                                # No data (e.g. over sea) counts as sea level
+                                return [result['elevation'] if result['elevation'] is not None else 0 for result in results]
+                            problem = f"got {len(results)} elevations for {len(batch)} points"
+                    else:
+                        problem = f"HTTP {response.status_code}"
+            if attempt < self.retries:
+                print(f"Elevation request failed ({problem}), retrying...")
+                await asyncio.sleep(2**attempt)
+        raise RuntimeError(f"Elevation request failed {self.retries + 1} times ({problem})")
+
+
+class DEMProvider:
+    # Local elevation model: SRTM .hgt tiles (e.g. N61E006.hgt) and/or GeoTIFFs in one
+    # folder. Tiles are memory-mapped, so only the pixels around the points are read.
+    cached = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tiles = [] # (path, kind, lat_max, lon_min, pixel_lat, pixel_lon, nodata)
+        self.grids = {}
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension == '.hgt':
+                self.tiles.append(read_hgt_header(path))
+            elif extension in ('.tif', '.tiff'):
+                self.tiles.append(read_geotiff_header(path))
+        if not self.tiles:
+            raise ValueError(f"No .hgt or GeoTIFF tiles found in {directory}")
+        print(f"Using {len(self.tiles)} elevation tiles from {directory}")
+
+    def get_elevations(self, coordinates):
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        lat = coordinates[:, 0]
+        lon = coordinates[:, 1]
+        elevations = np.full(len(coordinates), np.nan)
+        for path, kind, lat_max, lon_min, pixel_lat, pixel_lon, nodata in self.tiles:
+            grid = self.get_grid(path, kind)
+            rows = (lat_max - lat) / pixel_lat
+            cols = (lon - lon_min) / pixel_lon
+            inside = np.isnan(elevations) & (rows >= 0) & (rows <= grid.shape[0] - 1) & (cols >= 0) & (cols <= grid.shape[1] - 1)
+            if inside.any():
+                elevations[inside] = sample_bilinear(grid, rows[inside], cols[inside], nodata)
+        missing = np.count_nonzero(np.isnan(elevations))
+        if missing:
+            raise RuntimeError(f"{missing} points are outside the elevation tiles in {self.directory}")
+        return elevations.tolist()
+
+    def get_grid(self, path, kind):
+        if path not in self.grids:
+            if kind == 'hgt':
+                size = int(round((os.path.getsize(path) // 2) ** 0.5))
+                self.grids[path] = np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+            else:
+                import tifffile
+                try:
+                    self.grids[path] = tifffile.memmap(path, mode='r')
+                except ValueError: # Compressed or tiled, can't be mapped directly
+                    self.grids[path] = tifffile.imread(path)
+        return self.grids[path]
+
+
+def read_hgt_header(path):
+    # Position is in the name: N61E006.hgt has its south-west corner at 61N 6E
+    match = re.match(r'([NS])(\d+)([EW])(\d+)', os.path.basename(path).upper())
+    if match is None:
+        raise ValueError(f"Can't read tile position from {path}")
+    lat_south = int(match.group(2)) * (1 if match.group(1) == 'N' else -1)
+    lon_west = int(match.group(4)) * (1 if match.group(3) == 'E' else -1)
+    size = int(round((os.path.getsize(path) // 2) ** 0.5)) # 1201 (3") or 3601 (1")
+    pixel = 1 / (size - 1)
+    return (path, 'hgt', lat_south + 1, lon_west, pixel, pixel, -32768)
+
+
+def read_geotiff_header(path):
+    import tifffile
+    with tifffile.TiffFile(path) as tif:
+        tags = tif.pages[0].tags
+        pixel_lon, pixel_lat = tags['ModelPixelScaleTag'].value[:2]
+        i, j, _, x, y, _ = tags['ModelTiepointTag'].value[:6]
+        nodata = None
+        if 'GDAL_NODATA' in tags:
+            nodata = float(tags['GDAL_NODATA'].value.strip('\x00 '))
+    return (path, 'tif', y + j * pixel_lat, x - i * pixel_lon, pixel_lat, pixel_lon, nodata)
+
+
+def sample_bilinear(grid, rows, cols, nodata):
+    # Bilinear interpolation between the 4 pixels around each (row, col); voids count as 0
+    row_low = np.clip(np.floor(rows).astype(int), 0, grid.shape[0] - 2)
+    col_low = np.clip(np.floor(cols).astype(int), 0, grid.shape[1] - 2)
+    t = rows - row_low
+    u = cols - col_low
+    corners = []
+    for row_offset, col_offset in ((0, 0), (0, 1), (1, 0), (1, 1)):
+        values = np.asarray(grid[row_low + row_offset, col_low + col_offset], dtype=float)
+        if nodata is not None:
+            values[values == nodata] = 0
+        corners.append(values)
+    ele_00, ele_01, ele_10, ele_11 = corners
+    return (1 - t) * (1 - u) * ele_00 + (1 - t) * u * ele_01 + t * (1 - u) * ele_10 + t * u * ele_11
+
+
+class FakeProvider:
+    # In-process elevations for tests: function(lat, lon) on arrays, flat sea level by default
+    cached = False
+
+    def __init__(self, function=None):
+        self.function = function
+        self.calls = []
+
+    def get_elevations(self, coordinates):
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self.calls.append(len(coordinates))
+        if self.function is None:
+            return [0.0] * len(coordinates)
+        return np.asarray(self.function(coordinates[:, 0], coordinates[:, 1]), dtype=float).tolist()
+
+
+def get_elevation_provider(source, url='https://api.opentopodata.org/v1/', calls_per_second=1, max_concurrent=4):
+    # 'opentopodata', 'fake', or a folder with .hgt/GeoTIFF tiles. The rest is for opentopodata
+    if source == 'opentopodata':
+        return OpenTopoDataProvider(url=url, calls_per_second=calls_per_second, max_concurrent=max_concurrent)
+    if source == 'fake':
+        return FakeProvider()
+    if os.path.isdir(source):
+        return DEMProvider(source)
+    raise ValueError(f"Unknown elevation source: {source}")
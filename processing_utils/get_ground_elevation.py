@@ -1,118 +1,72 @@
-import requests
-import math
-import json
-import os
-import time
-
-def get_ground_elevation_from_api(locations):
-    url = "https://api.opentopodata.org/v1/aster30m"
-    # Joining locations as a pipe-separated string of lat,lon pairs
-    locations_param = '|'.join([f"{lat},{lon}" for lat, lon in locations])
-    print("Calling API for elevation data")
-    response = requests.get(url, params={"locations": locations_param})
-    if response.status_code == 200:
-        data = response.json()
-        # Extract just the elevation from each result and return as a list
-        elevations = [result['elevation'] for result in data['results']]
-        return elevations
-    else:
-        print(f"Error: {response.status_code}")
-        return []
-
-
-def get_ground_elevation(coordinates, precision_lat=0.01, precision_lon=0.01):
-    filename = 'elevation_cache.json'
-    # Check if json exists
-    if os.path.exists(filename):
-        with open(filename, 'r') as file:
-            elevation_data = json.load(file)
-    else:
-        elevation_data = []
-    cached_coordinates = [sublist[:2] for sublist in elevation_data]
-
-    # Make list with all desired coordinates
-    coordinate_list = []
-    for point in coordinates:
-        lat, lon = point
-        # Round the coordinates to the specified precision to create grid keys
-        lat_low = round(math.floor(lat / precision_lat) * precision_lat, 5)
-        lat_high = round(math.ceil(lat / precision_lat) * precision_lat, 5)
-        lon_low = round(math.floor(lon / precision_lon) * precision_lon, 5)
-        lon_high = round(math.ceil(lon / precision_lon) * precision_lon, 5)
-        keys = [[lat_low, lon_low], [lat_low, lon_high], [lat_high, lon_low], [lat_high, lon_high]]
-
-        for i, key in enumerate(keys):
-            if key not in coordinate_list:
-                coordinate_list.append(key)
-    
-    # Make list of coordinates not found locally
-    coordinate_list_api = []
-    for point in coordinate_list:
-        if point not in cached_coordinates:
-            coordinate_list_api.append(point)
-
-    # Get elevations from API
-    batch_size = 100
-    elevations = []
-    for i in range(0, len(coordinate_list_api), batch_size):
-        batch = coordinate_list_api[i:i+batch_size]
-        elevations.extend(get_ground_elevation_from_api(batch))
-        time.sleep(1)  # Respect the 1 call per second limit
-    
-    # Store new elevations in json
-    for i, point in enumerate(coordinate_list_api):
-        elevation_data.append(point + [elevations[i]])
-        with open(filename, 'w') as file:
-            json.dump(elevation_data, file, indent=4)
-
-    # Interpolate all trackpoints from elevation grid
-    trackpoint_elevations = []
-    for point in coordinates:
-        lat, lon = point
-        
-        lat_low = round(math.floor(lat / precision_lat) * precision_lat, 5)
-        lat_high = round(math.ceil(lat / precision_lat) * precision_lat, 5)
-        lon_low = round(math.floor(lon / precision_lon) * precision_lon, 5)
-        lon_high = round(math.ceil(lon / precision_lon) * precision_lon, 5)
-
-        ele_ll = next(item for item in elevation_data if item[:2] == [lat_low, lon_low])[2]
-        ele_lh = next(item for item in elevation_data if item[:2] == [lat_low, lon_high])[2]
-        ele_hl = next(item for item in elevation_data if item[:2] == [lat_high, lon_low])[2]
-        ele_hh = next(item for item in elevation_data if item[:2] == [lat_high, lon_high])[2]
-
-        # Bilinear interpolation
-        if lat_high == lat_low and lon_high != lon_low:
-            # Point falls on a horizontal grid line, interpolate only in longitude
-            interpolated_elevation = (
-                (lon_high - lon) / (lon_high - lon_low) * ele_ll +
-                (lon - lon_low) / (lon_high - lon_low) * ele_lh
-            )
-        elif lon_high == lon_low and lat_high != lat_low:
-            # Point falls on a vertical grid line, interpolate only in latitude
-            interpolated_elevation = (
-                (lat_high - lat) / (lat_high - lat_low) * ele_ll +
-                (lat - lat_low) / (lat_high - lat_low) * ele_hl
-            )
-        elif lat_high == lat_low and lon_high == lon_low:
-            # Point exactly matches a grid point (no interpolation needed)
-            interpolated_elevation = ele_ll  # All ele_ll, ele_lh, ele_hl, ele_hh should be the same
+import numpy as np
+from .elevation_cache import open_elevation_cache, load_elevations, store_elevations
+from .elevation_providers import OpenTopoDataProvider, ElevationFetchError
+
+def get_ground_elevation(coordinates, precision_lat=0.01, precision_lon=0.01, provider=None):
+    # Grid corners around every point, rounded to the grid like the cache entries
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    lat = coordinates[:, 0]
+    lon = coordinates[:, 1]
+    lat_low = np.round(np.floor(lat / precision_lat) * precision_lat, 5)
+    lat_high = np.round(np.ceil(lat / precision_lat) * precision_lat, 5)
+    lon_low = np.round(np.floor(lon / precision_lon) * precision_lon, 5)
+    lon_high = np.round(np.ceil(lon / precision_lon) * precision_lon, 5)
+    corner_lats = np.concatenate((lat_low, lat_low, lat_high, lat_high))
+    corner_lons = np.concatenate((lon_low, lon_high, lon_low, lon_high))
+    # (lat, lon) in 1e-5 degrees; as integers they make exact keys
+    corner_keys = np.round(np.column_stack((corner_lats, corner_lons)) * 10**5).astype(np.int64)
+    unique_keys, corner_index = np.unique(corner_keys, axis=0, return_inverse=True)
+    lat_key_min, lon_key_min = unique_keys.min(axis=0).tolist()
+    lat_key_max, lon_key_max = unique_keys.max(axis=0).tolist()
+    unique_keys = [tuple(key) for key in unique_keys.tolist()]
+
+    if provider is None:
+        provider = OpenTopoDataProvider()
+
+    connection = open_elevation_cache() if provider.cached else None
+    try:
+        if connection is not None:
+            elevation_index = load_elevations(connection, lat_key_min, lat_key_max, lon_key_min, lon_key_max)
         else:
-            # Normal bilinear interpolation
-            den = (lon_high - lon_low) * (lat_high - lat_low)
-            fxy1 = ((lon_high - lon) * (lat_high - lat) / den * ele_ll +
-                    (lon - lon_low) * (lat_high - lat) / den * ele_lh)
-            fxy2 = ((lon_high - lon) * (lat - lat_low) / den * ele_hl +
-                    (lon - lon_low) * (lat - lat_low) / den * ele_hh)
-            interpolated_elevation = fxy1 + fxy2
-        
-        trackpoint_elevations.append(interpolated_elevation)
-
-    return trackpoint_elevations
-
-
-
-
-
-
-
-
+            elevation_index = {}
+
+        # Make list of coordinates not found locally
+        keys_missing = [key for key in unique_keys if key not in elevation_index]
+
+        # Fetch in chunks, so a failure later on keeps what was already fetched
+        chunk_size = 1000
+        for i in range(0, len(keys_missing), chunk_size):
+            chunk = keys_missing[i:i+chunk_size]
+            try:
+                elevations = provider.get_elevations([[lat_key / 10**5, lon_key / 10**5] for lat_key, lon_key in chunk])
+            except ElevationFetchError as error:
+                # Keep the batches of this chunk that did arrive
+                if connection is not None:
+                    fetched = [(key, elevation) for key, elevation in zip(chunk, error.partial) if elevation is not None]
+                    store_elevations(connection, [key for key, _ in fetched], [elevation for _, elevation in fetched])
+                raise
+            if connection is not None:
+                store_elevations(connection, chunk, elevations)
+            elevation_index.update(zip(chunk, elevations))
+    finally:
+        if connection is not None:
+            connection.close()
+
+    # Interpolate all trackpoints from elevation grid, in one pass
+    unique_elevations = np.array([elevation_index[key] for key in unique_keys], dtype=float)
+    ele_ll, ele_lh, ele_hl, ele_hh = unique_elevations[corner_index.reshape(-1)].reshape(4, -1)
+
+    # Bilinear interpolation. A point on a grid line has equal low and high corners;
+    # its weight along that axis is 0, which gives the 1-D (or no) interpolation.
+    lat_span = lat_high - lat_low
+    lon_span = lon_high - lon_low
+    t = np.divide(lat - lat_low, lat_span, out=np.zeros_like(lat), where=lat_span != 0)
+    u = np.divide(lon - lon_low, lon_span, out=np.zeros_like(lon), where=lon_span != 0)
+    trackpoint_elevations = (
+        (1 - t) * (1 - u) * ele_ll +
+        (1 - t) * u * ele_lh +
+        t * (1 - u) * ele_hl +
+        t * u * ele_hh
+    )
+
+    return trackpoint_elevations.tolist()
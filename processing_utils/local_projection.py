@@ -0,0 +1,23 @@
+import numpy as np
+
+radius = 6371000.0
+
+
+def project_local(lons, lats, lat_ref=None):
+    # Equirectangular projection to meters around lat_ref (default: mean latitude).
+    # Good enough for distances within a flight, and straight lines stay straight.
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    if lat_ref is None:
+        lat_ref = np.mean(lats)
+    x = lons / 180 * np.pi * np.cos(lat_ref / 180 * np.pi) * radius
+    y = lats / 180 * np.pi * radius
+    return x, y
+
+
+def flat_distance(lon1, lat1, lon2, lat2):
+    # Same as calculate_distance in the collect_* modules, for arrays
+    lat = (lat1 + lat2) / 2
+    y_distance = (lat1 - lat2) / 180 * np.pi * radius
+    x_distance = (lon1 - lon2) / 180 * np.pi * np.cos(lat / 180 * np.pi) * radius
+    return np.sqrt(y_distance * y_distance + x_distance * x_distance)
@@ -1,6 +1,10 @@
-import gpxpy
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime, timezone
+import numpy as np
 
 def parse_gpx(gpx_file):
+    import gpxpy
     gpx = gpxpy.parse(gpx_file)
     track_points = [] 
     
@@ -11,3 +15,51 @@ def parse_gpx(gpx_file):
     return track_points
 
 
+# Track points of a GPX file as columns like read_igc: time (seconds since epoch, UTC), lat,
+# lon and gps_alt (0 where missing). The file is read incrementally and every point is
+# removed from the tree once read, so memory doesn't grow with the file beyond the columns.
+# Points without a time are skipped.
+def read_gpx(gpx_file_path):
+    columns = {key: array('d') for key in ['time', 'lat', 'lon', 'gps_alt']}
+    names = LocalNames()
+    parents = []
+    for event, elem in ET.iterparse(gpx_file_path, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        tag = names[elem.tag]
+        if tag not in ('trkpt', 'rtept', 'wpt'):
+            continue
+        if tag == 'trkpt':
+            time = None
+            altitude = 0
+            for child in elem:
+                name = names[child.tag]
+                if name == 'time' and child.text:
+                    time = epoch_seconds(child.text)
+                elif name == 'ele' and child.text:
+                    altitude = float(child.text)
+            if time is not None and 'lat' in elem.attrib and 'lon' in elem.attrib:
+                columns['time'].append(time)
+                columns['lat'].append(float(elem.attrib['lat']))
+                columns['lon'].append(float(elem.attrib['lon']))
+                columns['gps_alt'].append(altitude)
+        del parents[-1][:] # The point, and the ones before it, are done
+    return {key: np.array(values) for key, values in columns.items()}
+
+
+class LocalNames(dict):
+    # Tag -> tag without its namespace, so GPX 1.0 and 1.1 (and TCX versions) read the same.
+    # Only a few different tags per file, each split once.
+    def __missing__(self, tag):
+        self[tag] = tag.rpartition('}')[2]
+        return self[tag]
+
+
+def epoch_seconds(text):
+    # ISO 8601 time -> seconds since epoch. Times without a timezone are taken as UTC
+    timestamp = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
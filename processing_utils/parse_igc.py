@@ -1,5 +1,8 @@
 
 from datetime import datetime, timedelta
+import numpy as np
+
+epoch_ordinal = datetime(1970, 1, 1).toordinal()
 
 def parse_igc(igc_file_path):
     track_points = []
@@ -44,3 +47,88 @@ def parse_igc(igc_file_path):
 
     return track_points
 
+
+
+# Same fixes as parse_igc, as columns: time (seconds since epoch, UTC), lat, lon, gps_alt and
+# pressure_alt. The file is read as bytes and all B records are decoded at once from their
+# fixed positions; only the header lines are handled one by one.
+def read_igc(igc_file_path):
+    with open(igc_file_path, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+
+    # Lines, split at \n and \r like reading in text mode
+    breaks = np.flatnonzero((data == ord('\n')) | (data == ord('\r')))
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(data)]))
+    first = np.full(len(starts), -1)
+    has_text = starts < ends
+    first[has_text] = data[starts[has_text]]
+
+    # Date headers, in file order; B records use the last date before them
+    header_starts = starts[first == ord('H')]
+    header_ends = ends[first == ord('H')]
+    date_lines = []
+    date_days = []
+    base_day = datetime(2000, 1, 1).toordinal() - epoch_ordinal # Base time for the flight
+    for start, end in zip(header_starts.tolist(), header_ends.tolist()):
+        line = data[start:end].tobytes().decode('utf-8', errors='replace')
+        if line.startswith('HFDTEDATE:'):
+            day, month, year = map(int, [line[10:12], line[12:14], line[14:16]])
+        elif line.startswith('HFDTE'):
+            day, month, year = map(int, [line[5:7], line[7:9], line[9:11]])
+        else:
+            continue
+        date_lines.append(start)
+        date_days.append(datetime(year + 2000, month, day).toordinal() - epoch_ordinal) # Assuming year 2000+
+
+    # Fix lines, long enough for both altitudes
+    is_fix = (first == ord('B')) & (ends - starts >= 35)
+    fix_starts = starts[is_fix]
+    if len(fix_starts) == 0:
+        return {key: np.zeros(0) for key in ['time', 'lat', 'lon', 'gps_alt', 'pressure_alt']}
+
+    # The first 35 characters of every fix, digits as numbers (other characters count as 0)
+    records = data[fix_starts[:, None] + np.arange(35)]
+    digits = records - ord('0')
+    digits[digits > 9] = 0
+
+    def field(begin, end):
+        # Integer value of the characters [begin, end) of every fix line, exact in floats
+        return digits[:, begin:end].astype(float) @ (10.0 ** np.arange(end - begin - 1, -1, -1))
+
+    def signed_field(begin, end):
+        values = field(begin, end)
+        return np.where((records[:, begin:end] == ord('-')).any(axis=1), -values, values)
+
+    time_of_day = (field(1, 3) * 3600 + field(3, 5) * 60 + field(5, 7)).astype(np.int64)
+    lat = field(7, 9) + field(9, 14) / 60000
+    lat[records[:, 14] == ord('S')] *= -1
+    lon = field(15, 18) + field(18, 23) / 60000
+    lon[records[:, 23] == ord('W')] *= -1
+    pressure_alt = signed_field(25, 30) # Works for most, but 0 from gpsdump!
+    gps_alt = signed_field(30, 35) # Usually more precise
+
+    # Date of every fix, from the last date header before it (index 0 is the default date)
+    date_index = np.searchsorted(np.array(date_lines, dtype=np.int64), fix_starts)
+    day = np.array([base_day] + date_days, dtype=np.int64)[date_index]
+    time = day * 86400 + time_of_day
+
+    # Time rollover at midnight: a day is added whenever the time goes backwards. A date
+    # header starts over from its own date, so this is done per header section.
+    time_offset = np.zeros(len(time), dtype=np.int64)
+    section_starts = np.flatnonzero(np.diff(date_index)) + 1
+    last_time = None
+    for begin, end in zip(np.concatenate(([0], section_starts)).tolist(), np.concatenate((section_starts, [len(time)])).tolist()):
+        section = time[begin:end]
+        offset = 86400 if last_time is not None and section[0] < last_time else 0
+        time_offset[begin:end] = offset + 86400 * np.concatenate(([0], np.cumsum(section[1:] < section[:-1])))
+        last_time = section[-1] + time_offset[end - 1]
+    time = time + time_offset
+
+    return {
+        'time': time.astype(float),
+        'lat': lat,
+        'lon': lon,
+        'gps_alt': gps_alt,
+        'pressure_alt': pressure_alt,
+    }
@@ -1,6 +1,9 @@
 
 import xml.etree.ElementTree as ET
+from array import array
 from datetime import datetime
+import numpy as np
+from .parse_gpx import LocalNames, epoch_seconds
 
 def parse_tcx(tcx_file_path):
     tree = ET.parse(tcx_file_path)
@@ -27,3 +30,32 @@ def parse_tcx(tcx_file_path):
 
     return track_points
 
+
+
+# Trackpoints of a TCX file as columns like read_igc: time (seconds since epoch, UTC), lat,
+# lon, gps_alt (0 where missing) and speed (m/s, NaN where missing). Read incrementally,
+# every trackpoint is removed from the tree once read. Trackpoints without a time or a
+# position (e.g. while the GPS has no fix) are skipped.
+def read_tcx(tcx_file_path):
+    columns = {key: array('d') for key in ['time', 'lat', 'lon', 'gps_alt', 'speed']}
+    names = LocalNames()
+    parents = []
+    for event, elem in ET.iterparse(tcx_file_path, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if names[elem.tag] != 'Trackpoint':
+            continue
+        values = {}
+        for child in elem.iter():
+            if child.text:
+                values[names[child.tag]] = child.text
+        if 'Time' in values and 'LatitudeDegrees' in values and 'LongitudeDegrees' in values:
+            columns['time'].append(epoch_seconds(values['Time']))
+            columns['lat'].append(float(values['LatitudeDegrees']))
+            columns['lon'].append(float(values['LongitudeDegrees']))
+            columns['gps_alt'].append(float(values.get('AltitudeMeters', 0)))
+            columns['speed'].append(float(values.get('Speed', 'nan')))
+        del parents[-1][:] # The trackpoint, and the ones before it, are done
+    return {key: np.array(values) for key, values in columns.items()}
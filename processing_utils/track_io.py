@@ -0,0 +1,92 @@
+import csv
+import json
+import os
+from datetime import datetime, timezone
+import numpy as np
+from .track_table import TrackTable
+
+# Intermediate track_points on disk: a directory with one .npy file per column and a
+# schema.json (column names, dtypes, shapes, track timezone). Loading memory-maps the
+# columns copy-on-write, so nothing is parsed or copied until it is used, and changes
+# made while rendering never reach the files.
+
+
+def save_track_points(track_points, path='track_points'):
+    os.makedirs(path, exist_ok=True)
+    schema_path = os.path.join(path, 'schema.json')
+    if os.path.exists(schema_path):
+        os.remove(schema_path) # Columns don't match an old schema while being written
+    columns = {}
+    for key, values in track_points.columns.items():
+        values = np.asarray(values)
+        filename = f"{key}.npy"
+        np.save(os.path.join(path, filename), values, allow_pickle=values.dtype == object)
+        columns[key] = {'file': filename, 'dtype': values.dtype.str, 'shape': list(values.shape)}
+    schema = {'version': 1, 'length': len(track_points), 'timezone': track_points.timezone, 'columns': columns}
+    with open(schema_path, 'w') as f:
+        json.dump(schema, f, indent=1)
+    print(f"Data exported to {path}/.")
+
+
+def load_track_points(path='track_points'):
+    # A directory written by save_track_points, or else the CSV written by export_to_csv
+    schema_path = os.path.join(path, 'schema.json')
+    if not os.path.exists(schema_path):
+        csv_path = path if path.endswith('.csv') else f"{path}.csv"
+        print(f"No {schema_path}, reading {csv_path}")
+        return read_track_points_csv(csv_path)
+    with open(schema_path) as f:
+        schema = json.load(f)
+    columns = {}
+    for key, column in schema['columns'].items():
+        if column['dtype'] == '|O': # Python objects can't be memory-mapped
+            columns[key] = np.load(os.path.join(path, column['file']), allow_pickle=True)
+        else:
+            columns[key] = np.load(os.path.join(path, column['file']), mmap_mode='c')
+    return TrackTable(columns, schema['timezone'])
+
+
+def read_track_points_csv(filename='track_points.csv'):
+    # Old format: one row per frame, nested values as JSON
+    rows = []
+    datetime_fields = ['local_time', 'timestamp']
+    with open(filename, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            for key, value in row.items():
+                try:
+                    # Try converting to float if possible
+                    row[key] = float(value)
+                except ValueError:
+                    # Check if it's a datetime field and convert
+                    if key in datetime_fields:
+                        row[key] = datetime.fromisoformat(value)
+                    elif value == '':
+                        row[key] = np.nan # Missing value
+                    else:
+                        # If conversion fails, check if it's a JSON string
+                        try:
+                            row[key] = json.loads(value)
+                        except json.JSONDecodeError:
+                            # If it's not JSON, leave it as the original string
+                            pass
+            rows.append(row)
+
+    columns = {}
+    for key in rows[0] if rows else []:
+        values = [row[key] for row in rows]
+        if key == 'map_coordinate':
+            columns['map_xy'] = np.array([[(p["x"], p["y"]) for p in value] for value in values], dtype=float)
+        elif key == 'timestamp':
+            columns[key] = np.array([to_naive_utc(value) for value in values], dtype='datetime64[us]')
+        elif all(isinstance(value, float) for value in values):
+            columns[key] = np.array(values)
+        else:
+            columns[key] = np.array(values, dtype=object) # e.g. local_time, with its UTC offset
+    return TrackTable(columns)
+
+
+def to_naive_utc(timestamp):
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
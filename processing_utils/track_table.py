@@ -0,0 +1,115 @@
+import numpy as np
+from collections.abc import MutableMapping
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+
+class TrackTable:
+    # Columnar track: one NumPy array per field, one row per output frame.
+    #   track_points["lat"]  -> whole column (array)
+    #   track_points[i]      -> dict-like row, so per-point code keeps working
+    # Timestamps are datetime64[us] (UTC). Minimap pixels live in one array "map_xy"
+    # of shape (n_points, n_maps, 2). row["map_xy"] is that row of the array; the old
+    # "map_coordinate" list of dicts is still there, but built on every access.
+    # "local_time" is computed from the timestamp and the track's timezone.
+
+    def __init__(self, columns=None, timezone=None):
+        self.columns = dict(columns) if columns is not None else {}
+        self.timezone = timezone
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError("track point index out of range")
+        return TrackRow(self, key)
+
+    def __setitem__(self, key, values):
+        self.columns[key] = np.asarray(values)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TrackRow(self, i)
+
+    def row_keys(self):
+        # Field names as seen through a row
+        keys = []
+        for key in self.columns:
+            if key == 'map_xy':
+                keys.append('map_coordinate')
+            else:
+                keys.append(key)
+        if self.timezone is not None and 'timestamp' in self.columns:
+            keys.append('local_time')
+        return keys
+
+    def get_value(self, key, i):
+        if key == 'map_coordinate' and 'map_xy' in self.columns:
+            return [{"x": float(x), "y": float(y)} for x, y in self.columns['map_xy'][i]]
+        if key == 'local_time' and self.timezone is not None:
+            utc_time = self.columns['timestamp'][i].item()
+            return utc_time.replace(tzinfo=ZoneInfo('UTC')).astimezone(ZoneInfo(self.timezone))
+        value = self.columns[key][i]
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, float) and value != value: # NaN marks a missing value
+            return None
+        return value
+
+    def set_value(self, key, i, value):
+        if key == 'map_coordinate':
+            if 'map_xy' not in self.columns:
+                self.columns['map_xy'] = np.full((len(self), len(value), 2), np.nan)
+            self.columns['map_xy'][i] = [(p["x"], p["y"]) for p in value]
+            return
+        if key not in self.columns:
+            self.columns[key] = empty_column(value, len(self))
+        if value is None:
+            value = np.nan
+        self.columns[key][i] = value
+
+
+def empty_column(value, length):
+    # Column with a dtype that fits value, filled with "missing"
+    if isinstance(value, (bool, np.bool_)):
+        return np.zeros(length, dtype=bool)
+    if isinstance(value, (int, np.integer)):
+        return np.zeros(length, dtype=np.int64)
+    if isinstance(value, datetime):
+        return np.full(length, np.datetime64('NaT'), dtype='datetime64[us]')
+    if value is None or isinstance(value, (float, np.floating)):
+        return np.full(length, np.nan)
+    return np.full(length, None, dtype=object)
+
+
+class TrackRow(MutableMapping):
+    # Dict-like view of one row of a TrackTable. Writes go straight into the columns.
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.table.get_value(key, self.index)
+
+    def __setitem__(self, key, value):
+        self.table.set_value(key, self.index, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Can't delete a field from a single track point")
+
+    def __iter__(self):
+        return iter(self.table.row_keys())
+
+    def __len__(self):
+        return len(self.table.row_keys())
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,55 @@
+import math
+from itertools import combinations
+import numpy as np
+import pytest
+from processing_utils.collect_3tp_distances import prefix_3tp_distances
+from processing_utils.distance_rows import distance_row_blocks
+
+
+def calculate_distance(point1, point2):
+    # The original per-pair distance of collect_3tp_distances
+    radius = 6371000.0
+    lat = (point1[1] + point2[1]) / 2
+    y_distance = (point1[1] - point2[1]) / 180 * math.pi * radius
+    x_distance = (point1[0] - point2[0]) / 180 * math.pi * math.cos(lat / 180 * math.pi) * radius
+    return math.sqrt(y_distance * y_distance + x_distance * x_distance)
+
+
+def brute_force_3tp(points, end_idx):
+    # Every start -> a -> b -> c -> end with 0 < a < b < c < end
+    best = 0
+    for a, b, c in combinations(range(1, end_idx), 3):
+        best = max(best, calculate_distance(points[0], points[a]) + calculate_distance(points[a], points[b])
+            + calculate_distance(points[b], points[c]) + calculate_distance(points[c], points[end_idx]))
+    return best
+
+
+def random_track(n, seed):
+    rng = np.random.default_rng(seed)
+    lons = 8 + np.cumsum(rng.normal(scale=0.01, size=n))
+    lats = 46 + np.cumsum(rng.normal(scale=0.01, size=n))
+    return lons, lats
+
+
+@pytest.mark.parametrize('memory_budget_mb', [1e-6, 0.002, 0.02, 4]) # Blocks of 1 row up to all rows at once
+def test_matches_brute_force(memory_budget_mb):
+    lons, lats = random_track(28, seed=1)
+    points = list(zip(lons.tolist(), lats.tolist()))
+    expected = [brute_force_3tp(points, i) for i in range(len(points))]
+    np.testing.assert_allclose(prefix_3tp_distances(lons, lats, memory_budget_mb), expected, rtol=1e-9)
+
+
+def test_budgets_give_the_same_result():
+    lons, lats = random_track(600, seed=2)
+    block_counts = []
+    results = []
+    for memory_budget_mb in [0.01, 0.1, 1, 16]:
+        block_counts.append(sum(1 for _ in distance_row_blocks(lons, lats, memory_budget_mb)))
+        results.append(prefix_3tp_distances(lons, lats, memory_budget_mb))
+    assert block_counts[0] > block_counts[-1] == 1
+    for result in results[1:]:
+        np.testing.assert_allclose(result, results[0], rtol=1e-12)
+
+
+def test_short_tracks_have_no_3tp_distance():
+    assert prefix_3tp_distances(np.array([8.0, 8.1, 8.2, 8.3]), np.array([46.0, 46.1, 46.0, 46.1])).tolist() == [0, 0, 0, 0]
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+import pytest
+from processing_utils import elevation_providers
+from processing_utils import OpenTopoDataProvider, ElevationFetchError
+from processing_utils import get_ground_elevation
+from processing_utils.elevation_cache import open_elevation_cache, load_elevations
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        if isinstance(self.payload, Exception):
+            raise self.payload
+        return self.payload
+
+
+class FakeSession:
+    # Stand-in for requests.Session. Elevation is 100 * lat + lon. Batches starting at
+    # lat 1 get a broken body the first time, batches starting at lat 2 always get HTTP 500.
+    calls = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get(self, url, params, timeout):
+        points = [[float(value) for value in location.split(',')] for location in params['locations'].split('|')]
+        cls = FakeSession
+        with cls.lock:
+            cls.calls.append(points[0][0])
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            first_try = cls.calls.count(points[0][0]) == 1
+        time.sleep(0.02)
+        with cls.lock:
+            cls.active -= 1
+        if points[0][0] == 2:
+            return FakeResponse(500, None)
+        if points[0][0] == 1 and first_try:
+            return FakeResponse(200, ValueError('Expecting value'))
+        return FakeResponse(200, {'results': [{'elevation': 100 * lat + lon} for lat, lon in points]})
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    FakeSession.calls = []
+    FakeSession.max_active = 0
+    monkeypatch.setattr(elevation_providers.requests, 'Session', FakeSession)
+    # No waiting between retries
+    sleep = asyncio.sleep
+    monkeypatch.setattr(elevation_providers.asyncio, 'sleep', lambda seconds: sleep(0))
+    return FakeSession
+
+
+def batch(lat, size=3):
+    return [[lat, lon] for lon in range(size)]
+
+
+def test_bad_response_is_retried(fake_session):
+    provider = OpenTopoDataProvider(batch_size=3, calls_per_second=1000, max_concurrent=2, retries=1)
+    elevations = provider.get_elevations(batch(0) + batch(1) + batch(3))
+    assert elevations == [0, 1, 2, 100, 101, 102, 300, 301, 302]
+    assert sorted(fake_session.calls) == [0, 1, 1, 3]
+    assert fake_session.max_active == 2
+
+
+def test_finished_batches_are_kept(fake_session):
+    provider = OpenTopoDataProvider(batch_size=3, calls_per_second=1000, retries=2)
+    with pytest.raises(ElevationFetchError) as error:
+        provider.get_elevations(batch(0) + batch(2) + batch(1))
+    assert error.value.partial == [0, 1, 2, None, None, None, 100, 101, 102]
+    assert fake_session.calls.count(2) == 3
+
+
+def test_ground_elevation_caches_what_arrived(fake_session, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # Elevation cache is created in the working directory
+    provider = OpenTopoDataProvider(batch_size=2, calls_per_second=1000, retries=0)
+    coordinates = [[0.005, 0.005], [2.005, 0.005]]
+    with pytest.raises(ElevationFetchError):
+        get_ground_elevation(coordinates, provider=provider)
+
+    # Every batch but the failing one (the corners at lat 2.00) went into the cache
+    connection = open_elevation_cache()
+    cached = load_elevations(connection, 0, 201000, 0, 1000)
+    connection.close()
+    assert sorted(cached) == [(0, 0), (0, 1000), (1000, 0), (1000, 1000), (201000, 0), (201000, 1000)]
+    assert cached[(201000, 1000)] == pytest.approx(100 * 2.01 + 0.01)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from processing_utils.collect_open_distances import prefix_open_distances
+from processing_utils.local_projection import project_local, flat_distance
+
+
+def random_track(n, lat_span, seed):
+    # Random walk with some long straight legs, starting in the Alps
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(size=(n, 2)) + np.repeat(rng.normal(scale=3, size=(n // 50 + 1, 2)), 50, axis=0)[:n]
+    track = np.cumsum(steps, axis=0)
+    track = (track - track.min(axis=0)) / np.ptp(track, axis=0)
+    return 8 + track[:, 0] * lat_span, 46 + track[:, 1] * lat_span
+
+
+def brute_force(pairs):
+    # Largest of the pairwise distances between the first i + 1 points, for every i
+    return np.maximum.accumulate(np.tril(pairs, -1).max(axis=1))
+
+
+@pytest.mark.parametrize('lat_span', [0.5, 40]) # One flight, and a track over much of a hemisphere
+@pytest.mark.parametrize('block_size', [1, 7, 256])
+def test_matches_brute_force(lat_span, block_size):
+    lons, lats = random_track(700, lat_span, seed=int(lat_span) + block_size)
+    x, y = project_local(lons, lats)
+    expected = brute_force(np.hypot(x[:, None] - x, y[:, None] - y))
+    np.testing.assert_allclose(prefix_open_distances(lons, lats, block_size), expected, rtol=1e-12)
+
+
+def test_close_to_pairwise_flat_distance_within_a_flight():
+    lons, lats = random_track(500, 0.5, seed=3)
+    expected = brute_force(flat_distance(lons[:, None], lats[:, None], lons, lats))
+    np.testing.assert_allclose(prefix_open_distances(lons, lats)[1:], expected[1:], rtol=5e-3)
+
+
+def test_degenerate_tracks():
+    assert prefix_open_distances([8.0], [46.0]).tolist() == [0]
+    np.testing.assert_allclose(prefix_open_distances([8.0] * 5, [46.0] * 5), 0)
@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from processing_utils import read_igc, parse_igc
+
+
+def fix(time, lat='4612345N', lon='00812345E', pressure_alt='01000', gps_alt='01010'):
+    return f"B{time}{lat}{lon}A{pressure_alt}{gps_alt}\n"
+
+
+def write_igc(tmp_path, lines, newline='\n'):
+    path = tmp_path / 'flight.igc'
+    path.write_bytes(''.join(lines).replace('\n', newline).encode('ascii'))
+    return str(path)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('date_header', ['HFDTEDATE:150724,01\n', 'HFDTE150724\n'])
+def test_date_headers(tmp_path, date_header):
+    path = write_igc(tmp_path, ['AXXX001\n', date_header, 'HFPLTPILOTINCHARGE: Someone\n', fix('120000')])
+    assert read_igc(path)['time'].tolist() == [utc(2024, 7, 15, 12)]
+
+
+def test_midnight_rollover(tmp_path):
+    path = write_igc(tmp_path, ['HFDTEDATE:310724,01\n', fix('235958'), fix('235959'), fix('000001'), fix('000002')], newline='\r\n')
+    assert read_igc(path)['time'].tolist() == [utc(2024, 7, 31, 23, 59, 58), utc(2024, 7, 31, 23, 59, 59), utc(2024, 8, 1, 0, 0, 1), utc(2024, 8, 1, 0, 0, 2)]
+
+
+def test_rollover_carries_into_a_new_header(tmp_path):
+    # A second date header for the same day, after midnight has passed
+    lines = ['HFDTE150724\n', fix('235959'), 'HFDTE150724\n', fix('000001'), fix('000002')]
+    assert read_igc(write_igc(tmp_path, lines))['time'].tolist() == [utc(2024, 7, 15, 23, 59, 59), utc(2024, 7, 16, 0, 0, 1), utc(2024, 7, 16, 0, 0, 2)]
+
+
+def test_matches_parse_igc(tmp_path):
+    lines = ['HFDTEDATE:150724,01\n', 'LXXX comment\n',
+        fix('101500', '4612345N', '00812345E', '01000', '01010'),
+        fix('101501', '0130000S', '07030000W', '-0012', '00000'),
+        'E101502PEV\n',
+        fix('101502', '4559999N', '17959999E', '00000', '-0005')]
+    path = write_igc(tmp_path, lines)
+    columns = read_igc(path)
+    expected = parse_igc(path)
+    assert columns['time'].tolist() == [timestamp.replace(tzinfo=timezone.utc).timestamp() for timestamp, _, _, _ in expected]
+    np.testing.assert_allclose(columns['lat'], [lat for _, lat, _, _ in expected])
+    np.testing.assert_allclose(columns['lon'], [lon for _, _, lon, _ in expected])
+    assert columns['gps_alt'].tolist() == [1010, 0, -5]
+    assert columns['pressure_alt'].tolist() == [1000, -12, 0]
+
+
+def test_no_fixes(tmp_path):
+    columns = read_igc(write_igc(tmp_path, ['HFDTE150724\n', 'B1200\n']))
+    assert sorted(columns) == ['gps_alt', 'lat', 'lon', 'pressure_alt', 'time']
+    assert all(len(values) == 0 for values in columns.values())
@@ -0,0 +1,54 @@
+import numpy as np
+from processing_utils import read_tcx
+
+
+tcx = '''<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">
+  <Activities><Activity Sport="Other"><Lap StartTime="2024-07-15T10:00:00Z"><Track>
+    <Trackpoint>
+      <Time>2024-07-15T10:00:00Z</Time>
+      <Position><LatitudeDegrees>46.1</LatitudeDegrees><LongitudeDegrees>8.1</LongitudeDegrees></Position>
+      <AltitudeMeters>1000.5</AltitudeMeters>
+      <Extensions><ns3:TPX><ns3:Speed>4.5</ns3:Speed></ns3:TPX></Extensions>
+    </Trackpoint>
+    <Trackpoint>
+      <Time>2024-07-15T10:00:01Z</Time>
+      <HeartRateBpm><Value>120</Value></HeartRateBpm>
+    </Trackpoint>
+    <Trackpoint>
+      <Time>2024-07-15T12:00:02+02:00</Time>
+      <Position><LatitudeDegrees>-46.2</LatitudeDegrees><LongitudeDegrees>-8.2</LongitudeDegrees></Position>
+    </Trackpoint>
+    <Trackpoint>
+      <Position><LatitudeDegrees>46.3</LatitudeDegrees><LongitudeDegrees>8.3</LongitudeDegrees></Position>
+      <AltitudeMeters>1003</AltitudeMeters>
+    </Trackpoint>
+    <Trackpoint>
+      <Time>2024-07-15T10:00:04</Time>
+      <Position><LatitudeDegrees>46.4</LatitudeDegrees><LongitudeDegrees>8.4</LongitudeDegrees></Position>
+      <AltitudeMeters></AltitudeMeters>
+      <Extensions><ns3:TPX><ns3:Speed>6</ns3:Speed></ns3:TPX></Extensions>
+    </Trackpoint>
+  </Track></Lap></Activity></Activities>
+</TrainingCenterDatabase>
+'''
+
+
+def test_trackpoints_with_missing_children(tmp_path):
+    path = tmp_path / 'flight.tcx'
+    path.write_text(tcx)
+    columns = read_tcx(str(path))
+
+    # No position (2nd) or no time (4th): skipped. No altitude: 0, no speed: NaN
+    start = 1721037600 # 2024-07-15 10:00:00 UTC
+    assert columns['time'].tolist() == [start, start + 2, start + 4]
+    assert columns['lat'].tolist() == [46.1, -46.2, 46.4]
+    assert columns['lon'].tolist() == [8.1, -8.2, 8.4]
+    assert columns['gps_alt'].tolist() == [1000.5, 0, 0]
+    np.testing.assert_array_equal(columns['speed'], [4.5, np.nan, 6])
+
+
+def test_empty_track(tmp_path):
+    path = tmp_path / 'empty.tcx'
+    path.write_text('<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2"/>')
+    assert all(len(values) == 0 for values in read_tcx(str(path)).values())
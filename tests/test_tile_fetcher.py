@@ -0,0 +1,115 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import pytest
+from PIL import Image
+from map_utils import TileFetcher, TileStore
+
+
+def tile_png(x, y, zoom):
+    buffer = BytesIO()
+    Image.new('RGB', (8, 8), (x % 256, y % 256, zoom)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class TileServer:
+    # Stand-in for Mapbox: /{zoom}/{x}/{y}.png, answers 503 to the first request for every
+    # tile in flaky, 404 for x < 0, and counts how many requests it handles at once
+    def __init__(self, delay=0.02, flaky=()):
+        self.delay = delay
+        self.flaky = set(flaky)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                zoom, x, y = (int(part) for part in self.path.strip('/').removesuffix('.png').split('/'))
+                with server.lock:
+                    server.requests.append((x, y, zoom))
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                    first_try = server.requests.count((x, y, zoom)) == 1
+                time.sleep(server.delay)
+                with server.lock:
+                    server.active -= 1
+                if x < 0:
+                    self.send_error(404)
+                elif first_try and (x, y, zoom) in server.flaky:
+                    self.send_error(503)
+                else:
+                    body = tile_png(x, y, zoom)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url_template = f"http://127.0.0.1:{self.httpd.server_address[1]}/{{zoom}}/{{x}}/{{y}}.png"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = TileServer(flaky=[(1, 0, 5), (2, 0, 5)])
+    yield server
+    server.close()
+
+
+def test_fetch_tiles_retries_and_reports(server, tmp_path, capsys):
+    store = TileStore(cache_dir=str(tmp_path), source=server.url_template)
+    fetcher = TileFetcher(server.url_template, max_workers=4, backoff=0, store=store)
+    tiles = [[x, 0, 5] for x in range(12)]
+
+    failed = fetcher.fetch_tiles(tiles)
+
+    assert failed == []
+    for x, y, zoom in tiles:
+        assert store.has_tile(x, y, zoom)
+        assert store.get_tile_image(x, y, zoom).getpixel((0, 0))[:3] == (x, 0, 5)
+    # Flaky tiles were asked for twice, the rest once
+    assert server.requests.count((1, 0, 5)) == 2
+    assert server.requests.count((3, 0, 5)) == 1
+    assert len(server.requests) == len(tiles) + 2
+    # Downloads overlap, but never more than max_workers at a time
+    assert 1 < server.max_active <= 4
+    assert "Downloaded 12 tiles in" in capsys.readouterr().out
+
+
+def test_fetch_tiles_gives_up_on_404(server, tmp_path, capsys):
+    store = TileStore(cache_dir=str(tmp_path), source=server.url_template)
+    fetcher = TileFetcher(server.url_template, max_workers=2, max_retries=3, backoff=0, store=store)
+
+    failed = fetcher.fetch_tiles([[-1, 0, 5], [4, 0, 5]])
+
+    assert failed == [[-1, 0, 5]]
+    assert server.requests.count((-1, 0, 5)) == 1 # 404 is not retried
+    output = capsys.readouterr().out
+    assert "HTTP 404" in output
+    assert "Downloaded 1 tiles in" in output
+
+
+def test_custom_source_is_cached_apart_from_mapbox(server, tmp_path):
+    store = TileStore(cache_dir=str(tmp_path), source=server.url_template)
+    TileFetcher(server.url_template, backoff=0, store=store).fetch_tiles([[3, 0, 5]])
+
+    mapbox_store = TileStore(cache_dir=str(tmp_path))
+    assert store.has_tile(3, 0, 5)
+    assert not mapbox_store.has_tile(3, 0, 5)
+    # A store only serves the source it was made for
+    with pytest.raises(ValueError):
+        TileFetcher(server.url_template, store=mapbox_store)
+    with pytest.raises(ValueError):
+        TileFetcher(store=store)
@@ -0,0 +1,89 @@
+import os
+import pickle
+import time
+from io import BytesIO
+import pytest
+from PIL import Image
+from map_utils import TileStore
+
+
+def tile_png(value, size=16):
+    # Uncompressed, so tiles of one size all take the same number of bytes
+    buffer = BytesIO()
+    Image.new('RGB', (size, size), (value, 0, 0)).save(buffer, 'PNG', compress_level=0)
+    return buffer.getvalue()
+
+
+def stored(store):
+    return sorted(x for x, y, zoom in store.connection.execute('SELECT x, y, zoom FROM tile_index'))
+
+
+@pytest.fixture(params=[False, True], ids=['files', 'packed'])
+def store(request, tmp_path):
+    return TileStore(cache_dir=str(tmp_path), packed=request.param, memory_tiles=2)
+
+
+def test_round_trip_survives_reopening(store, tmp_path):
+    store.put_tile(3, 5, 4, tile_png(30))
+    reopened = TileStore(cache_dir=str(tmp_path), packed=store.packed)
+    assert reopened.has_tile(3, 5, 4)
+    assert not reopened.has_tile(5, 3, 4)
+    assert reopened.get_tile_image(3, 5, 4).getpixel((0, 0)) == (30, 0, 0)
+    assert reopened.get_tile_image(5, 3, 4) is None
+    assert pickle.loads(pickle.dumps(reopened)).get_tile_image(3, 5, 4).getpixel((0, 0)) == (30, 0, 0)
+
+
+def test_packed_rows_are_tms(tmp_path):
+    store = TileStore(cache_dir=str(tmp_path), packed=True)
+    store.put_tile(3, 5, 4, tile_png(30))
+    assert store.connection.execute('SELECT zoom_level, tile_column, tile_row FROM tiles').fetchall() == [(4, 3, 2**4 - 1 - 5)]
+
+
+def test_memory_keeps_least_recently_used(store):
+    for x in range(3):
+        store.put_tile(x, 0, 8, tile_png(x))
+    store.get_tile_image(0, 0, 8)
+    store.get_tile_image(1, 0, 8)
+    store.get_tile_image(0, 0, 8)
+    store.get_tile_image(2, 0, 8)
+    assert list(store.images) == [(0, 0, 8), (2, 0, 8)]
+
+
+def test_evict_old_tiles(store):
+    for x in range(4):
+        store.put_tile(x, 0, 8, tile_png(x))
+    two_years_ago = time.time() - 2 * 365 * 24 * 3600
+    for x in (1, 2):
+        store.add_to_index(x, 0, 8, len(tile_png(x)), two_years_ago)
+    store.get_tile_image(1, 0, 8)
+
+    assert store.evict(keep=[(2, 0, 8)]) == 1
+    assert stored(store) == [0, 2, 3]
+    assert not store.has_tile(1, 0, 8)
+    assert (1, 0, 8) not in store.images
+
+
+def test_evict_least_recently_used_down_to_cap(store):
+    size = len(tile_png(0))
+    for x in range(10):
+        assert len(tile_png(x)) == size
+        store.put_tile(x, 0, 8, tile_png(x))
+    store.get_tile_image(0, 0, 8) # Now the most recently used
+    store.max_bytes = 4 * size
+
+    assert store.evict(keep=[(1, 0, 8)]) == 6
+    assert stored(store) == [0, 1, 8, 9]
+    assert store.evict() == 0
+
+
+def test_evict_shrinks_packed_file(tmp_path):
+    store = TileStore(cache_dir=str(tmp_path), packed=True, max_mb=1)
+    for x in range(60):
+        store.put_tile(x, 0, 8, os.urandom(50000))
+    store.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    path = tmp_path / 'tiles.mbtiles'
+    full_size = path.stat().st_size
+
+    store.evict()
+    assert path.stat().st_size < full_size / 2
+    assert os.path.getsize(f"{path}-wal") == 0
@@ -0,0 +1,57 @@
+from datetime import datetime
+import numpy as np
+from processing_utils import TrackTable, save_track_points, load_track_points
+
+
+def make_track():
+    n = 5
+    return TrackTable({
+        'timestamp': np.datetime64('2024-07-15T10:00:00', 'us') + np.arange(n) * np.timedelta64(1, 's'),
+        'lat': np.linspace(46, 46.1, n),
+        'lon': np.linspace(8, 8.1, n),
+        '3tp_dist': np.arange(n, dtype=np.int64) * 100,
+        'map_xy': np.arange(n * 3 * 2, dtype=float).reshape(n, 3, 2),
+        'note': np.array(['a', None, 'c', {'x': 1}, 5], dtype=object),
+    }, 'Europe/Zurich')
+
+
+def test_round_trip(tmp_path):
+    track_points = make_track()
+    path = str(tmp_path / 'track_points')
+    save_track_points(track_points, path)
+    loaded = load_track_points(path)
+
+    assert len(loaded) == len(track_points)
+    assert loaded.timezone == 'Europe/Zurich'
+    assert list(loaded.columns) == list(track_points.columns)
+    for key, values in track_points.columns.items():
+        assert loaded[key].dtype == values.dtype
+        assert loaded[key].shape == values.shape
+        assert loaded[key].tolist() == values.tolist()
+    assert isinstance(loaded['map_xy'], np.memmap)
+    assert loaded[3]['local_time'] == datetime.fromisoformat('2024-07-15T12:00:03+02:00')
+    assert loaded[1]['map_coordinate'] == [{'x': 6.0, 'y': 7.0}, {'x': 8.0, 'y': 9.0}, {'x': 10.0, 'y': 11.0}]
+
+
+def test_changes_after_loading_stay_in_memory(tmp_path):
+    path = str(tmp_path / 'track_points')
+    save_track_points(make_track(), path)
+    loaded = load_track_points(path)
+    loaded['lat'][0] = 0
+    loaded['map_xy'] += 1
+    loaded['elevation'] = np.zeros(len(loaded))
+
+    reloaded = load_track_points(path)
+    assert reloaded['lat'][0] == 46
+    assert reloaded['map_xy'][0, 0].tolist() == [0, 1]
+    assert 'elevation' not in reloaded.columns
+
+
+def test_save_over_older_track(tmp_path):
+    path = str(tmp_path / 'track_points')
+    save_track_points(make_track(), path)
+    shorter = TrackTable({'lat': np.array([1.0, 2.0])})
+    save_track_points(shorter, path)
+    loaded = load_track_points(path)
+    assert list(loaded.columns) == ['lat']
+    assert loaded['lat'].tolist() == [1, 2]